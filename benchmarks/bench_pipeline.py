@@ -0,0 +1,198 @@
+"""
+End-to-end benchmark of the pipeline stages (fetch, parse, posters, render) against a local Allociné stub,
+see stub_server.py, for synthetic catalogs of increasing sizes.
+
+Each catalog is benchmarked in its own process, so that peak RSS figures do not leak from one size to another.
+Run it from the repository root, e.g.:
+
+    PYTHONPATH=.:cinema PROJECT_PATH=cinema python -m benchmarks.bench_pipeline --theaters 10 100 1000
+"""
+
+import json
+import os
+import resource
+import socket
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from itertools import count
+from multiprocessing import Event, Process
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, List
+
+from benchmarks.stub_server import recorded_payloads_in, serve
+from cinema import http_client
+from cinema.cinemas_sources import allocine
+from cinema.models import Cinema
+from cinema.output_generator import generate_html_files
+from cinema.posters import localize_posters
+from cinema.settings import CACHE_PATH, FETCH_CONCURRENCY
+
+
+THEATERS_PER_CITY = 10
+
+
+@dataclass
+class StageReport:
+    theaters: int
+    stage: str
+    wall_time: float
+    cpu_time: float
+    requests: int
+    peak_rss_mb: float
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.requests / self.wall_time if self.wall_time else 0
+
+
+def _cpu_time() -> float:
+    """CPU time of this process and of its terminated children (e.g. the posters resizing pool)."""
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return max(own.ru_maxrss, children.ru_maxrss) / 1024
+
+
+def _count_requests():
+    """Count the requests made through the shared HTTP client, return the counter."""
+    requests_counter = count()
+    get = http_client.get
+
+    def counting_get(*args, **kwargs):
+        next(requests_counter)
+        return get(*args, **kwargs)
+
+    http_client.get = counting_get
+    return requests_counter
+
+
+def synthetic_catalog(theaters_count: int) -> Dict[str, List[Cinema]]:
+    cinemas = {}
+    for theater_index in range(theaters_count):
+        city = f"Ville {theater_index // THEATERS_PER_CITY:03d}"
+        cinemas.setdefault(city, []).append(
+            Cinema(name=f"Cinéma {theater_index}", code=f"B{theater_index:05d}", city=city, type="allocine", website="")
+        )
+    return cinemas
+
+
+def bench_catalog(theaters_count: int, stub_url: str, concurrency: int) -> List[StageReport]:
+    """Run every stage on a synthetic catalog of `theaters_count` theaters. Runs in a dedicated process."""
+    allocine.SERVICE_URL = stub_url
+    allocine.HTTP_CACHE_ENABLED = False
+    # the stub is never throttled, the pipeline itself is measured
+    http_client.RATE_LIMIT_ENABLED = False
+    requests_counter = _count_requests()
+    reports = []
+
+    @contextmanager
+    def measure(stage: str):
+        start_wall, start_cpu, start_requests = perf_counter(), _cpu_time(), next(requests_counter)
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            yield
+        reports.append(
+            StageReport(
+                theaters=theaters_count,
+                stage=stage,
+                wall_time=perf_counter() - start_wall,
+                cpu_time=_cpu_time() - start_cpu,
+                # the counter was also incremented to read it
+                requests=next(requests_counter) - start_requests - 1,
+                peak_rss_mb=_peak_rss_mb(),
+            )
+        )
+
+    cinemas = synthetic_catalog(theaters_count)
+    coming_week_days = [date.today() + timedelta(days=i) for i in range(7)]
+    jobs = [
+        (city, cinema, day_index, day)
+        for city, city_cinemas in cinemas.items()
+        for cinema in city_cinemas
+        for day_index, day in enumerate(coming_week_days)
+    ]
+
+    with TemporaryDirectory() as out_dir:
+        out_path = Path(out_dir)
+        with measure("fetch"), ThreadPoolExecutor(max_workers=concurrency) as executor:
+            payloads = list(executor.map(lambda job: allocine._fetch_theater_day(job[1], job[3]), jobs))
+
+        with measure("parse"):
+            one_week_shows = {}
+            movies_fields = {}
+            for (city, cinema, day_index, _), payload in zip(jobs, payloads):
+                city_shows = one_week_shows.setdefault(city, [[] for _ in coming_week_days])
+                city_shows[day_index].extend(allocine._parse_theater_day(cinema, payload, movies_fields))
+
+        with measure("posters"):
+            localize_posters(one_week_shows, out_path, concurrency)
+
+        with measure("render"):
+            generate_html_files(cinemas, one_week_shows, out_path=out_path)
+
+    return reports
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _print_reports(reports: List[StageReport]):
+    header = ("theaters", "stage", "wall (s)", "requests", "req/s", "CPU (s)", "peak RSS (MB)")
+    print("{:>8}  {:<8} {:>9} {:>9} {:>8} {:>8} {:>14}".format(*header))
+    for report in reports:
+        print(
+            f"{report.theaters:>8}  {report.stage:<8} {report.wall_time:>9.3f} {report.requests:>9} "
+            f"{report.requests_per_second:>8.0f} {report.cpu_time:>8.3f} {report.peak_rss_mb:>14.1f}"
+        )
+
+
+def main():
+    parser = ArgumentParser(description="Benchmark the pipeline stages against a local Allociné stub.")
+    parser.add_argument("--theaters", type=int, nargs="+", default=[10, 100, 1000], help="catalog sizes to benchmark")
+    parser.add_argument("--concurrency", type=int, default=FETCH_CONCURRENCY)
+    parser.add_argument("--latency", type=float, default=0, help="seconds the stub waits before each response")
+    parser.add_argument(
+        "--fixtures",
+        type=Path,
+        default=CACHE_PATH / "allocine_showtimes",
+        help="directory of recorded showtimes payloads, synthetic payloads are served if there is none",
+    )
+    parser.add_argument("--json", type=Path, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    port = _free_port()
+    stub_ready = Event()
+    stub = Process(
+        target=serve, args=(port, recorded_payloads_in(args.fixtures), args.latency, stub_ready), daemon=True
+    )
+    stub.start()
+    stub_ready.wait()
+
+    reports = []
+    try:
+        for theaters_count in args.theaters:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                reports += executor.submit(
+                    bench_catalog, theaters_count, f"http://127.0.0.1:{port}", args.concurrency
+                ).result()
+    finally:
+        stub.terminate()
+
+    _print_reports(reports)
+    if args.json:
+        args.json.write_text(json.dumps([asdict(report) for report in reports], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the Allociné timestamps parsing: dateutil's parser versus the ISO-8601 fast path.
+
+Timestamps are read from recorded showtimes payloads, by default the ones kept in the showtimes cache
+by previous runs, or from the JSON files given as arguments. Run it from the repository root, e.g.:
+
+    PYTHONPATH=.:cinema python -m benchmarks.bench_timestamps [payload.json ...]
+"""
+
+import json
+import sys
+from itertools import chain
+from pathlib import Path
+from timeit import timeit
+from typing import List
+
+from dateutil.parser import parse as dateutil_parse
+
+from cinema.cinemas_sources import allocine
+from cinema.settings import CACHE_PATH
+
+
+def _load_timestamps(payload_paths: List[Path]) -> List[str]:
+    timestamps = []
+    for payload_path in payload_paths:
+        with open(payload_path) as f:
+            payload = json.load(f)
+        # showtimes cache entries wrap the payload, raw payloads are accepted too
+        payload = payload.get("payload", payload)
+        for movie in payload["results"]:
+            timestamps.extend(showtime["startsAt"] for showtime in chain.from_iterable(movie["showtimes"].values()))
+            if movie["movie"]:
+                timestamps.extend(
+                    release["releaseDate"]["date"]
+                    for release in movie["movie"]["releases"]
+                    if release.get("releaseDate")
+                )
+    return timestamps
+
+
+def _bench(label: str, parse, timestamps: List[str], number: int = 5):
+    duration = timeit(lambda: [parse(timestamp) for timestamp in timestamps], number=number) / number
+    print(f"{label:<32} {duration * 1000:8.2f} ms  ({duration / len(timestamps) * 1e6:.2f} µs/timestamp)")
+
+
+def _parse_datetime_cold(timestamp: str):
+    allocine._parse_datetime.cache_clear()
+    return allocine._parse_datetime(timestamp)
+
+
+def main():
+    payload_paths = [Path(arg) for arg in sys.argv[1:]] or sorted((CACHE_PATH / "allocine_showtimes").glob("*/*.json"))
+    timestamps = _load_timestamps(payload_paths)
+    if not timestamps:
+        sys.exit("No timestamps found, run a fetch first or give recorded payloads as arguments.")
+
+    print(f"{len(timestamps)} timestamps ({len(set(timestamps))} unique) from {len(payload_paths)} payloads")
+    _bench("dateutil", dateutil_parse, timestamps)
+    _bench("fromisoformat, no memoization", _parse_datetime_cold, timestamps)
+    allocine._parse_datetime.cache_clear()
+    _bench("fromisoformat, memoized", allocine._parse_datetime, timestamps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Local stub of the Allociné endpoints used by the allocine source, for benchmarks.
+
+Showtimes payloads are replayed from recorded JSON files (by default the ones kept in the showtimes cache by
+previous runs): each theater×day is mapped to one of them deterministically. Without recorded payloads,
+synthetic ones are generated. Poster URLs are rewritten to point to the stub, which serves generated pictures.
+
+Run it standalone with, e.g.:
+
+    PYTHONPATH=.:cinema python -m benchmarks.stub_server --port 8765
+"""
+
+import json
+import random
+import re
+import struct
+import zlib
+from argparse import ArgumentParser
+from functools import lru_cache
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import sleep
+from typing import List, Optional
+
+
+SHOWTIMES_PATH_RE = re.compile(r"^/_/showtimes/theater-(?P<code>[^/]+)/d-(?P<day>\d{4}-\d{2}-\d{2})/$")
+POSTER_PATH_RE = re.compile(r"^/posters/(?P<name>\w+)\.png$")
+SYNTHETIC_MOVIES_COUNT = 200
+
+
+@lru_cache(maxsize=1024)
+def _png(width: int, height: int, seed: str) -> bytes:
+    """A plain color PNG picture, so that the stub does not need any imaging library."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    color = md5(seed.encode()).digest()[:3]
+    raw_rows = b"".join(b"\x00" + color * width for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw_rows))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _synthetic_payload(code: str, day: str) -> dict:
+    """A showtimes payload shaped like Allociné ones, with 3 to 10 movies out of a fixed pool."""
+    rnd = random.Random(f"{code}/{day}")
+    results = []
+    for movie_id in rnd.sample(range(SYNTHETIC_MOVIES_COUNT), rnd.randint(3, 10)):
+        movie_rnd = random.Random(movie_id)
+        results.append(
+            {
+                "movie": {
+                    "internalId": movie_id,
+                    "title": f"Film {movie_id}",
+                    "synopsisFull": " ".join(["Lorem ipsum dolor sit amet."] * movie_rnd.randint(5, 40)),
+                    "runtime": f"{movie_rnd.randint(1, 2)}h {movie_rnd.randint(0, 59):02d}min",
+                    "credits": [
+                        {
+                            "position": {"name": "DIRECTOR"},
+                            "person": {"firstName": "Jane", "lastName": f"Doe{movie_id}"},
+                        }
+                    ],
+                    "releases": [
+                        {"releaseDate": {"date": f"{movie_rnd.randint(1950, 2026)}-0{movie_rnd.randint(1, 9)}-15"}}
+                    ],
+                    "relatedTags": [{"name": "Drame - Comédie"}, {"name": "Policier / Thriller"}],
+                    "poster": {"url": f"https://stub.invalid/posters/{movie_id}.jpg"},
+                },
+                "showtimes": {
+                    "original": [
+                        {"tags": ["Localization.Language.English"], "startsAt": f"{day}T{hour}:{minute}:00"}
+                        for hour, minute in sorted(
+                            {
+                                (rnd.randint(10, 22), rnd.choice(("00", "15", "30", "45")))
+                                for _ in range(rnd.randint(1, 5))
+                            }
+                        )
+                    ],
+                    "dubbed": [{"tags": ["Localization.Language.French"], "startsAt": f"{day}T16:00:00"}],
+                },
+            }
+        )
+    return {"results": results}
+
+
+@lru_cache(maxsize=None)
+def _read_recorded_payload(path: Path) -> str:
+    return path.read_text()
+
+
+class StubAllocineHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as the real site
+    # send headers and body in one segment, or delayed ACKs would add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+    wbufsize = -1
+    recorded_payloads: List[Path] = []
+    latency: float = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def _showtimes(self, code: str, day: str) -> bytes:
+        if self.recorded_payloads:
+            index = int(md5(f"{code}/{day}".encode()).hexdigest(), 16) % len(self.recorded_payloads)
+            payload = json.loads(_read_recorded_payload(self.recorded_payloads[index]))
+            # showtimes cache entries wrap the payload, raw payloads are accepted too
+            payload = payload.get("payload", payload)
+        else:
+            payload = _synthetic_payload(code, day)
+
+        host = self.headers.get("Host")
+        for movie in payload["results"]:
+            if movie["movie"] and movie["movie"].get("poster"):
+                poster_name = md5(movie["movie"]["poster"]["url"].encode()).hexdigest()
+                movie["movie"]["poster"] = {"url": f"http://{host}/posters/{poster_name}.png"}
+        return json.dumps(payload).encode()
+
+    def _send(self, status: int, content_type: Optional[str] = None, body: bytes = b""):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        sleep(self.latency)
+        if showtimes_match := SHOWTIMES_PATH_RE.match(self.path):
+            self._send(200, "application/json", self._showtimes(**showtimes_match.groupdict()))
+        elif poster_match := POSTER_PATH_RE.match(self.path):
+            self._send(200, "image/png", _png(600, 800, poster_match["name"]))
+        else:
+            self._send(404)
+
+
+def serve(port: int, recorded_payloads: List[Path], latency: float = 0, ready=None):
+    """Serve until killed. `ready` is an optional event set once the server listens."""
+    StubAllocineHandler.recorded_payloads = recorded_payloads
+    StubAllocineHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubAllocineHandler)
+    server.daemon_threads = True
+    if ready is not None:
+        ready.set()
+    server.serve_forever()
+
+
+def recorded_payloads_in(fixtures_path: Path) -> List[Path]:
+    return sorted(fixtures_path.glob("**/*.json"))
+
+
+def main():
+    from cinema.settings import CACHE_PATH
+
+    parser = ArgumentParser(description="Serve a local stub of the Allociné showtimes endpoints.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0, help="seconds to wait before each response")
+    parser.add_argument(
+        "--fixtures",
+        type=Path,
+        default=CACHE_PATH / "allocine_showtimes",
+        help="directory of recorded showtimes payloads, synthetic payloads are served if there is none",
+    )
+    args = parser.parse_args()
+
+    payloads = recorded_payloads_in(args.fixtures)
+    print(f"Serving {len(payloads) or 'synthetic'} payloads on http://127.0.0.1:{args.port}")
+    serve(args.port, payloads, args.latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Registry of the shows sources, by cinema type (the `type` column of cinemas.csv).
+
+Sources modules are only imported when a selected cinema needs them, so that heavy dependencies (e.g. selenium) are
+not loaded otherwise. Each source module exposes `fetch_next_week_shows(cinemas, days, concurrency, deadline)`,
+returning the shows of its cinemas by city and by day.
+"""
+
+from datetime import date, timedelta
+from importlib import import_module
+from threading import Thread
+from time import monotonic, perf_counter
+from typing import Dict, List, Optional
+
+from cinema import metrics
+from cinema.exceptions import SourceTimeout
+from cinema.models import Cinema, FilmShow
+from cinema.settings import FETCH_CONCURRENCY, SOURCES_TIME_BUDGETS
+from cinema.snapshot import last_snapshot, stale_shows
+
+
+SOURCES = {
+    "allocine": "cinema.cinemas_sources.allocine",
+    "custom": "cinema.cinemas_sources.besancon_scraper",
+}
+# seconds given to a source past its deadline, to parse what it fetched and complete it with the last known shows
+DEADLINE_GRACE = 10
+
+
+class _SourceRun(Thread):
+    """Fetch the shows of one source in the background, so that a late source can be given up."""
+
+    def __init__(
+        self,
+        source_type: str,
+        cinemas: Dict[str, List[Cinema]],
+        days: int,
+        concurrency: int,
+        deadline: Optional[float],
+    ):
+        # daemon, so that a source which is given up does not prevent the process from exiting
+        super().__init__(name=f"source-{source_type}", daemon=True)
+        self.source_type = source_type
+        self.cinemas = cinemas
+        self.days = days
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.shows = None
+        self.error = None
+
+    def run(self):
+        start = perf_counter()
+        try:
+            source = import_module(SOURCES[self.source_type])
+            self.shows = source.fetch_next_week_shows(
+                self.cinemas, days=self.days, concurrency=self.concurrency, deadline=self.deadline
+            )
+        except Exception as e:
+            self.error = e
+        metrics.set_value("cinema_source_duration_seconds", perf_counter() - start, source=self.source_type)
+
+
+def _last_known_shows(cinemas: Dict[str, List[Cinema]], days: int) -> Dict[str, List[List[FilmShow]]]:
+    """Shows of the saved snapshot for `cinemas`, marked as stale, for a source which failed."""
+    snapshot = last_snapshot()
+    coming_week_days = [date.today() + timedelta(days=i) for i in range(days)]
+    shows = {}
+    for city, city_cinemas in cinemas.items():
+        city_shows = [
+            [show for cinema in city_cinemas for show in stale_shows(snapshot, city, cinema.name, day)]
+            for day in coming_week_days
+        ]
+        if any(city_shows):
+            shows[city] = city_shows
+    return shows
+
+
+def fetch_next_week_shows(
+    cinemas: Dict[str, List[Cinema]],
+    days: int = 7,
+    concurrency: int = FETCH_CONCURRENCY,
+    deadline: Optional[float] = None,
+) -> Dict[str, List[List[FilmShow]]]:
+    """
+    Fetch shows of every source of `cinemas` concurrently, each one within its time budget (SOURCES_TIME_BUDGETS)
+    and the run `deadline` (a time.monotonic() timestamp), and merge them by city (in the `cinemas` order)
+    and by day (in the sources order).
+
+    Sources replace what they cannot fetch in time with the last known shows. A source which fails altogether,
+    or is still running after its deadline, is replaced with its last known shows in the saved snapshot,
+    so that the other ones are still published. Raise its error if every source failed without any known shows.
+    """
+    start = monotonic()
+    runs = []
+    for source_type in SOURCES:
+        source_cinemas = {
+            city: [cinema for cinema in city_cinemas if cinema.type == source_type]
+            for city, city_cinemas in cinemas.items()
+        }
+        source_cinemas = {city: city_cinemas for city, city_cinemas in source_cinemas.items() if city_cinemas}
+        if source_cinemas:
+            budget = SOURCES_TIME_BUDGETS.get(source_type)
+            source_deadline = deadline if budget is None else min(start + budget, deadline or float("inf"))
+            runs.append(_SourceRun(source_type, source_cinemas, days, concurrency, source_deadline))
+    unknown_types = {cinema.type for city_cinemas in cinemas.values() for cinema in city_cinemas} - set(SOURCES)
+    if unknown_types:
+        print(f"No source for cinemas of type {', '.join(sorted(unknown_types))}, skipping them.")
+
+    for source_run in runs:
+        source_run.start()
+
+    sources_shows = []
+    errors = []
+    for source_run in runs:
+        source_run.join(
+            None if source_run.deadline is None else max(source_run.deadline + DEADLINE_GRACE - monotonic(), 0)
+        )
+        if source_run.is_alive():
+            source_run.error = SourceTimeout(source_run.source_type, source_run.deadline - start)
+        if source_run.error:
+            print(f"Using the last known shows of source {source_run.source_type}: {source_run.error}")
+            metrics.inc("cinema_sources_total", source=source_run.source_type, result="failed")
+            errors.append(source_run.error)
+            source_run.shows = _last_known_shows(source_run.cinemas, days)
+        else:
+            metrics.inc("cinema_sources_total", source=source_run.source_type, result="succeeded")
+        sources_shows.append(source_run.shows)
+
+    if errors and len(errors) == len(runs) and not any(sources_shows):
+        raise errors[0]
+
+    shows = {}
+    for city in cinemas:
+        for source_shows in sources_shows:
+            if city not in source_shows:
+                continue
+            city_shows = shows.setdefault(city, [[] for _ in range(days)])
+            for day_shows, source_day_shows in zip(city_shows, source_shows[city]):
+                day_shows.extend(source_day_shows)
+    return shows
@@ -1,18 +1,31 @@
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import suppress
+from dataclasses import replace
 from datetime import date, datetime, timedelta
-from hashlib import md5
+from functools import lru_cache
 from itertools import chain
-from pathlib import Path
-from typing import TYPE_CHECKING, Dict, List, Optional
+from time import monotonic, time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 from urllib.parse import quote_plus
 
-import requests
 from dateutil.parser import parse as dateutil_parse
 from requests import JSONDecodeError
 
+from cinema import http_client, metrics
 from cinema.exceptions import RemoteResourceException
+from cinema.http_cache import CacheEntry, ResponseCache
 from cinema.models import FilmShow
-from cinema.settings import COMPRESS_PIC, OUT_PATH
+from cinema.settings import (
+    CACHE_PATH,
+    FETCH_CONCURRENCY,
+    HTTP_CACHE_ENABLED,
+    REQUEST_DEADLINE,
+    ROLLING_EAGER_DAYS,
+    ROLLING_WINDOW,
+    SHOWTIMES_CACHE_TTLS,
+)
+from cinema.snapshot import known_shows, last_snapshot, stale_shows
 
 
 if TYPE_CHECKING:
@@ -21,6 +34,21 @@ if TYPE_CHECKING:
 SERVICE_URL = "http://www.allocine.fr"
 SERVICE_TYPE = "allocine"
 
+_showtimes_cache = ResponseCache(CACHE_PATH / "allocine_showtimes")
+_showtimes_cache_ttls = SHOWTIMES_CACHE_TTLS
+
+
+@lru_cache(maxsize=4096)
+def _parse_datetime(value: str) -> datetime:
+    """
+    Parse an Allociné timestamp. They are ISO-8601 formatted and repeated a lot across theaters and days,
+    so parsing is memoized and only unexpected formats go through dateutil's (slow) heuristics.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return dateutil_parse(value)
+
 
 def _extract_directors(movie_meta: dict) -> str:
     directors_list = []
@@ -42,7 +70,7 @@ def _extract_release_date(movie_meta: dict) -> Optional[datetime]:
     for release in movie_meta["releases"][::-1]:
         # explore releases from oldest (last ones) to newest
         if release.get("releaseDate"):
-            release_date = dateutil_parse(release["releaseDate"]["date"])
+            release_date = _parse_datetime(release["releaseDate"]["date"])
             current_year = date.today().year
             # we only want month and day for current year movies
             release_date = (
@@ -67,113 +95,244 @@ def _extract_show_times(movie_showtimes: dict) -> set:
             # unknown lang tags format or content, let's assert the show is VO
             lang = None
         lang = "VF" if lang == "French" else "VO"
-        show_date = dateutil_parse(showtime["startsAt"])
+        show_date = _parse_datetime(showtime["startsAt"])
         showtimes.add(f"{show_date.hour}:{str(show_date.minute).zfill(2)} ({lang})")
 
     return showtimes
 
 
-def fetch_next_week_shows(cinemas: Dict[str, List["Cinema"]]) -> Dict[str, List[List[FilmShow]]]:
-    """
-    Fetch shows from Allociné for one week, from today.
+def set_showtimes_cache_ttls(ttls: Tuple[float, ...]):
+    """Use `ttls` instead of SHOWTIMES_CACHE_TTLS, e.g. the daily ones of the daemon."""
+    global _showtimes_cache_ttls
+    _showtimes_cache_ttls = ttls
 
-    Returns a dict where keys are cities names,
-    and values are a list of 7 days,
-    where each day is a list of FilmShow objects.
-    """
-    shows = {}
-    for city_name, city_cinemas in cinemas.items():
-        for cinema in city_cinemas:
-            if cinema.type != SERVICE_TYPE:
-                continue
 
-            coming_week_days = [date.today() + timedelta(days=i) for i in range(7)]
-            for day_idx, current_day in enumerate(coming_week_days):
-                formatted_day = current_day.strftime("%Y-%m-%d")
-                print(f"Fetching {cinema.name} shows for {formatted_day}...")
-                resource = f"{SERVICE_URL}/_/showtimes/theater-{cinema.code}/d-{formatted_day}/"
-                res = requests.get(resource)
-                try:
-                    res_json = res.json()
-                except JSONDecodeError:
-                    raise RemoteResourceException(resource, "invalid JSON response")
-                if res.status_code != 200:
-                    raise RemoteResourceException(resource, res_json)
-
-                for movie in res_json["results"]:
-                    movie_meta = movie["movie"]
-                    if not movie_meta:
-                        # show times not linked to any movie... what is that!? skipping.
-                        continue
-
-                    movie_title = movie["movie"]["title"]
-                    release_date = _extract_release_date(movie_meta)
-                    showtimes = _extract_show_times(movie["showtimes"])
-                    allocine_movie_url = f"/film/fichefilm_gen_cfilm={movie['movie']['internalId']}.html"
-                    tags = [tag["name"].split("/")[0].split("-")[0].strip() for tag in movie_meta["relatedTags"]]
-                    search_engines_query = quote_plus(f"{movie_title} {release_date}")
-
-                    poster_metas = movie_meta.get("poster")
-                    poster_url = poster_metas.get("url", "") if poster_metas else ""
-
-                    if not shows.get(city_name):
-                        # init the data structure that will store the shows
-                        shows[city_name] = [[] for _ in range(7)]
-
-                    film_show = FilmShow(
-                        label=movie_title + f"<br>({release_date})<br>{_extract_directors(movie_meta)}",
-                        cinema=cinema.name,
-                        allocine_url=SERVICE_URL + allocine_movie_url,
-                        yt_url=f"https://www.youtube.com/results?search_query=trailer+{search_engines_query}",
-                        sc_url=f"https://www.senscritique.com/search?query={search_engines_query}",
-                        rotten_tomatos_url=f"https://www.rottentomatoes.com/search?search={search_engines_query}",
-                        # langs=', '.join(movie_meta["languages"]),
-                        synopsis=movie_meta.get("synopsisFull") or "Synopsis indisponible",
-                        tags=" / ".join(tags),
-                        url=f"{SERVICE_URL}/seance/salle_gen_csalle={cinema.code}.html",
-                        poster_url=poster_url,
-                        seances="<br>".join(sorted(showtimes)) + f'<br><br>{movie_meta.get("runtime") or "??"}',
-                    )
-                    film_show.poster_url = download_poster(film_show)
-                    shows[city_name][day_idx].append(film_show)
-
-            print("... done!")
-
-        # remove days with no shows for the current city
-        if shows.get(city_name):
-            shows[city_name] = [day_shows or [] for day_shows in shows[city_name]]
+def _showtimes_cache_ttl(day: date) -> float:
+    days_from_today = max((day - date.today()).days, 0)
+    return _showtimes_cache_ttls[min(days_from_today, len(_showtimes_cache_ttls) - 1)]
 
-    return shows
 
+def _fetch_theater_day(
+    cinema: "Cinema",
+    day: date,
+    deadline: Optional[float] = None,
+    eager: bool = False,
+    known_since: Optional[float] = None,
+) -> Optional[dict]:
+    """
+    Fetch the raw Allociné showtimes of one theater for one day, within REQUEST_DEADLINE and the run `deadline`.
+    Fresh cached responses are reused as is, unless `eager`, expired ones are revalidated with a conditional request.
+    Return None if the showtimes are known to be the same as at `known_since`, there is nothing new to parse then.
+    """
+    formatted_day = day.strftime("%Y-%m-%d")
+    cache_entry = _showtimes_cache.load(formatted_day, cinema.code) if HTTP_CACHE_ENABLED else None
+    if cache_entry and not eager and cache_entry.is_fresh(_showtimes_cache_ttl(day)):
+        metrics.inc("cinema_cache_requests_total", cache="allocine_showtimes", result="hit")
+        return None if cache_entry.unchanged_since(known_since) else cache_entry.payload
+
+    print(f"Fetching {cinema.name} shows for {formatted_day}...")
+    resource = f"{SERVICE_URL}/_/showtimes/theater-{cinema.code}/d-{formatted_day}/"
+    request_deadline = min(monotonic() + REQUEST_DEADLINE, deadline or float("inf"))
+    res = http_client.get(
+        resource, deadline=request_deadline, headers=cache_entry.validators() if cache_entry else None
+    )
+    if res.status_code == 304 and cache_entry:
+        metrics.inc("cinema_cache_requests_total", cache="allocine_showtimes", result="revalidated")
+        _showtimes_cache.touch(formatted_day, cinema.code, cache_entry)
+        return None if cache_entry.unchanged_since(known_since) else cache_entry.payload
+
+    try:
+        res_json = res.json()
+    except JSONDecodeError:
+        raise RemoteResourceException(resource, "invalid JSON response")
+    if res.status_code != 200:
+        raise RemoteResourceException(resource, res_json)
+
+    if HTTP_CACHE_ENABLED:
+        metrics.inc("cinema_cache_requests_total", cache="allocine_showtimes", result="miss")
+        fetched_at = time()
+        _showtimes_cache.store(
+            formatted_day,
+            cinema.code,
+            CacheEntry(
+                payload=res_json,
+                fetched_at=fetched_at,
+                etag=res.headers.get("ETag"),
+                last_modified=res.headers.get("Last-Modified"),
+                stored_at=fetched_at,
+            ),
+        )
+    return res_json
+
+
+def _extract_movie_fields(movie_meta: dict) -> dict:
+    """Extract the FilmShow fields which only depend on the movie, whatever the theater or the day."""
+    movie_title = movie_meta["title"]
+    release_date = _extract_release_date(movie_meta)
+    allocine_movie_url = f"/film/fichefilm_gen_cfilm={movie_meta['internalId']}.html"
+    tags = [tag["name"].split("/")[0].split("-")[0].strip() for tag in movie_meta["relatedTags"]]
+    search_engines_query = quote_plus(f"{movie_title} {release_date}")
+
+    poster_metas = movie_meta.get("poster")
+    poster_url = poster_metas.get("url", "") if poster_metas else ""
+
+    return {
+        "label": movie_title + f"<br>({release_date})<br>{_extract_directors(movie_meta)}",
+        "allocine_url": SERVICE_URL + allocine_movie_url,
+        "yt_url": f"https://www.youtube.com/results?search_query=trailer+{search_engines_query}",
+        "sc_url": f"https://www.senscritique.com/search?query={search_engines_query}",
+        "rotten_tomatos_url": f"https://www.rottentomatoes.com/search?search={search_engines_query}",
+        # "langs": ', '.join(movie_meta["languages"]),
+        "synopsis": movie_meta.get("synopsisFull") or "Synopsis indisponible",
+        "tags": " / ".join(tags),
+        "poster_url": poster_url,
+    }
+
+
+def _parse_theater_day(cinema: "Cinema", res_json: dict, movies_fields: Dict[int, dict]) -> List[FilmShow]:
+    """
+    Build the FilmShow objects of one theater for one day.
+    `movies_fields` memoizes the movie-level fields by Allociné movie id, it is shared by a whole fetch run.
+    """
+    film_shows = []
+    for movie in res_json["results"]:
+        movie_meta = movie["movie"]
+        if not movie_meta:
+            # show times not linked to any movie... what is that!? skipping.
+            continue
+
+        movie_id = movie_meta["internalId"]
+        if movie_id not in movies_fields:
+            movies_fields[movie_id] = _extract_movie_fields(movie_meta)
+
+        showtimes = _extract_show_times(movie["showtimes"])
+        film_show = FilmShow(
+            cinema=cinema.name,
+            url=f"{SERVICE_URL}/seance/salle_gen_csalle={cinema.code}.html",
+            seances="<br>".join(sorted(showtimes)) + f'<br><br>{movie_meta.get("runtime") or "??"}',
+            **movies_fields[movie_id],
+        )
+        film_shows.append(film_show)
+
+    return film_shows
+
+
+def _last_known_shows(
+    city_name: str, cinema: "Cinema", day: date, movies_fields: Dict[int, dict], snapshot
+) -> List[FilmShow]:
+    """
+    Shows of a theater for a day which could not be fetched, marked as stale: the ones of its expired cached
+    response if there is one, or else the ones of the saved snapshot.
+    """
+    cache_entry = _showtimes_cache.load(day.strftime("%Y-%m-%d"), cinema.code) if HTTP_CACHE_ENABLED else None
+    if cache_entry:
+        # unless the cached response is the one which could not be parsed
+        with suppress(KeyError, TypeError, ValueError):
+            return [
+                replace(show, stale=True) for show in _parse_theater_day(cinema, cache_entry.payload, movies_fields)
+            ]
+    return stale_shows(snapshot, city_name, cinema.name, day)
 
-def download_poster(film_show: FilmShow) -> Optional[str]:
+
+def _reusable(known: Optional[List[FilmShow]]) -> Optional[List[FilmShow]]:
     """
-    Download poster and returns relative path to it.
-    Note: some films (too old, foreign countries) do not have posters.
+    Known shows of a theater for a day, unless the poster of one of them could not be downloaded: the snapshot only
+    keeps the local copy of posters, the day is parsed again for its remote URLs so that the download is retried.
     """
-    url = film_show.poster_url
-    if not url:
-        # some movies (too old, foreign countries) do not have posters
+    if known is not None and any(show.poster_url is None for show in known):
         return None
-    pic_directory = OUT_PATH / "pic"
-    pic_directory.mkdir(parents=True, exist_ok=True)
-
-    file_extension = Path(url).suffix
-    url_hash = md5(url.encode()).hexdigest()
-    filename = f"{url_hash}{file_extension}"
-    local_file_path = pic_directory / filename
-    if not local_file_path.is_file():  # if the file does not exist already
-        res = requests.get(url)
-        if not (200 <= res.status_code < 300):
-            print(f"Exception downloading {url}.")
-        else:
-            pic_bytes = res.content
-            with open(local_file_path, "wb") as f:
-                f.write(pic_bytes)
+    return known
+
+
+def fetch_next_week_shows(
+    cinemas: Dict[str, List["Cinema"]],
+    days: int = 7,
+    concurrency: int = FETCH_CONCURRENCY,
+    deadline: Optional[float] = None,
+    rolling: bool = ROLLING_WINDOW,
+) -> Dict[str, List[List[FilmShow]]]:
+    """
+    Fetch shows from Allociné for one week (or the given number of `days`), from today.
+
+    Every theater×day pair is fetched concurrently, with at most `concurrency` requests in flight,
+    then parsed in the catalog order so that the result does not depend on network timings.
+    Theater×day pairs which fail, or are not fetched by the `deadline` (a time.monotonic() timestamp),
+    get their last known shows instead, marked as stale.
 
-            # resize images to vignettes
-            if COMPRESS_PIC and subprocess.call(["convert", local_file_path, "-resize", "120x160", local_file_path]):
-                print(f"Exception during resizing of {local_file_path}")
+    In `rolling` mode, the window of the previous run (saved in the snapshot) is moved forward: the first
+    ROLLING_EAGER_DAYS are refreshed whatever the cache TTLs, the other days keep the shows parsed by the previous
+    run as long as their showtimes did not change (according to the cache, or to a conditional request once
+    expired), and only the days new to the window are fetched in full.
 
-    local_path = f"../pic/{filename}"
-    return local_path
+    Returns a dict where keys are cities names,
+    and values are a list of 7 days,
+    where each day is a list of FilmShow objects.
+    Posters URLs are the remote ones, see posters.localize_posters.
+    """
+    coming_week_days = [date.today() + timedelta(days=i) for i in range(days)]
+    if HTTP_CACHE_ENABLED:
+        _showtimes_cache.evict_buckets_before(coming_week_days[0].strftime("%Y-%m-%d"))
+
+    jobs = [
+        (city_name, cinema, day_idx, current_day)
+        for city_name, city_cinemas in cinemas.items()
+        for cinema in city_cinemas
+        if cinema.type == SERVICE_TYPE
+        for day_idx, current_day in enumerate(coming_week_days)
+    ]
+
+    snapshot = last_snapshot() if rolling else None
+    previous_shows = [
+        _reusable(known_shows(snapshot, city_name, cinema.name, current_day)) if rolling else None
+        for city_name, cinema, _, current_day in jobs
+    ]
+
+    shows = {}
+    movies_fields = {}
+    executor = ThreadPoolExecutor(max_workers=max(concurrency, 1))
+    futures = [
+        executor.submit(
+            _fetch_theater_day,
+            cinema,
+            current_day,
+            deadline,
+            eager=rolling and day_idx < ROLLING_EAGER_DAYS,
+            known_since=snapshot.saved_at if snapshot and known is not None else None,
+        )
+        for (_, cinema, day_idx, current_day), known in zip(jobs, previous_shows)
+    ]
+    try:
+        # futures are consumed in submission order, whatever the order they complete in
+        for (city_name, cinema, day_idx, current_day), future, known in zip(jobs, futures, previous_shows):
+            try:
+                res_json = future.result(timeout=max(deadline - monotonic(), 0) if deadline else None)
+                if res_json is None:
+                    film_shows = known
+                    metrics.inc("cinema_theater_days_total", source=SERVICE_TYPE, result="reused")
+                else:
+                    film_shows = _parse_theater_day(cinema, res_json, movies_fields)
+                    metrics.inc("cinema_theater_days_total", source=SERVICE_TYPE, result="fresh")
+            except (RemoteResourceException, FutureTimeoutError, KeyError, TypeError, ValueError, OSError) as e:
+                # a failed request, the deadline, an unexpected response or a cache write error only loses this pair
+                if isinstance(e, (RemoteResourceException, FutureTimeoutError)):
+                    reason = str(e) or "Deadline exceeded."
+                else:
+                    reason = f"Cannot read the shows of {current_day}: {e!r}."
+                print(f"{reason} Using the last known shows of {cinema.name}...")
+                snapshot = snapshot or last_snapshot()
+                film_shows = _last_known_shows(city_name, cinema, current_day, movies_fields, snapshot)
+                metrics.inc(
+                    "cinema_theater_days_total", source=SERVICE_TYPE, result="stale" if film_shows else "missing"
+                )
+            if not film_shows:
+                continue
+            if not shows.get(city_name):
+                # init the data structure that will store the shows
+                shows[city_name] = [[] for _ in range(days)]
+            shows[city_name][day_idx].extend(film_shows)
+    finally:
+        # theater×days given up at the deadline are not started, the ones in flight end with their own deadline
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    print("... done!")
+    return shows
@@ -1,360 +1,329 @@
 """
 This module is a web scrapper for the Petit Kursaal cinema in Besançon.
+
+The calendar of the cinema page is rendered by javascript, and scraped with a headless web browser by default, see
+besancon_browser.py. With BESANCON_SCRAPER=http, the shows are read from the Drupal settings of the page itself with
+plain HTTP requests instead, see parse_calendar(), falling back to the web browser if no show can be found.
+The layout parse_calendar() expects was reconstructed, not saved from the live page: the browser stays the default
+until tests/fixtures/les2scenes_cinema.html is replaced by a saved copy of the page.
+
+Only one venue is supported: the calendar does not tell where each show takes place, so every show is given to the
+Petit Kursaal (VENUE), and other cinemas of cinemas.csv sharing its website, such as the Espace, get none.
 """
 
-import time
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 from datetime import date, timedelta
-from typing import List
+from itertools import repeat
+from time import monotonic, time
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote_plus, urljoin, urlsplit
 
 from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.common import NoSuchDriverException
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.common.by import By
-from selenium.webdriver.firefox.options import Options
-from selenium.webdriver.firefox.service import Service
-from selenium.webdriver.support import expected_conditions
-from selenium.webdriver.support.ui import WebDriverWait
-from unidecode import unidecode
 
-from cinema.exceptions import GeckoDriverNotFound
-from cinema.models import FilmShow
-from cinema.settings import PROJECT_PATH
+from cinema import http_client, metrics
+from cinema.exceptions import RemoteResourceException, UnexpectedPageLayout
+from cinema.http_cache import CacheEntry, ResponseCache
+from cinema.models import Cinema, FilmShow
+from cinema.settings import (
+    BESANCON_SCRAPER,
+    CACHE_PATH,
+    DETAILS_CACHE_TTL,
+    FETCH_CONCURRENCY,
+    HTTP_CACHE_ENABLED,
+    REQUEST_DEADLINE,
+)
 
 
 SERVICE_URL = "https://les2scenes.fr/cinema"
+SERVICE_TYPE = "custom"
+# the cinema of cinemas.csv given the shows of the calendar
+VENUE = "Petit Kursaal"
 
+_details_cache = ResponseCache(CACHE_PATH / "besancon_details")
 
-MONTHS_FR = (
-    "janvier",
-    "fevrier",
-    "mars",
-    "avril",
-    "mai",
-    "juin",
-    "juillet",
-    "aout",
-    "septembre",
-    "octobre",
-    "novembre",
-    "decembre",
-)
+# (label, url) of a show, as in the calendar popup of its day, e.g. ("18h15 The Big Lebowski", ".../big-lebowski")
+CalendarEntry = Tuple[str, str]
 
+# ISO dates, e.g. 2024-06-04, or jsCalendar's format, e.g. 04/06/2024
+_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})|(\d{2})/(\d{2})/(\d{4})")
 
-def _get_next_month(month: str):
-    must_return = False
-    for cur_month in MONTHS_FR:
-        if must_return:
-            return cur_month
-        elif cur_month == month:
-            must_return = True
-    # default case: decembre must return janvier
-    return MONTHS_FR[0]
-
-
-def _init_web_browser():
-    """Download gecko driver here: https://github.com/mozilla/geckodriver/releases."""
-    # Set up Selenium WebDriver with Firefox
-    firefox_options = Options()
-    firefox_options.add_argument("--headless")  # comment this line for debugging
-    firefox_options.set_preference(
-        "general.useragent.override", "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:91.0) Gecko/20100101 Firefox/126.0"
-    )
-    geckodriver_path = PROJECT_PATH / "geckodriver"
-    service = Service(geckodriver_path)
+
+def _parse_date(value) -> Optional[date]:
+    if not isinstance(value, str):
+        return None
+    match = _DATE_RE.fullmatch(value.strip())
+    if not match:
+        return None
+    year, month, day = match.group(1, 2, 3) if match.group(1) else match.group(6, 5, 4)
     try:
-        driver = webdriver.Firefox(service=service, options=firefox_options)
-    except NoSuchDriverException:
-        raise GeckoDriverNotFound()
+        return date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def _popup_entries(markup: str) -> Iterator[CalendarEntry]:
+    """Entries of the markup of a day popup, `ul > li > a` links to the films pages of the site."""
+    for link in BeautifulSoup(markup, "html.parser").select("ul > li > a[href]"):
+        url = urljoin(SERVICE_URL, link["href"])
+        if urlsplit(url).hostname == urlsplit(SERVICE_URL).hostname:
+            yield link.get_text(" ", strip=True), url
 
-    driver.get(SERVICE_URL)
-    wait = WebDriverWait(driver, 1)
-    wait.until(expected_conditions.visibility_of_element_located((By.ID, "calendar")))
 
-    # Get the page source and parse it
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    return driver, soup
+def _calendar_days(node, in_calendar: bool = False) -> Iterator[Tuple[date, CalendarEntry]]:
+    """
+    Entries of the `calendar` setting of the page: the popup markup of each day, under its date.
+    Anything outside of it (news, menus...) is ignored, even with dates and links.
+    """
+    if not isinstance(node, dict):
+        return
+    for key, value in node.items():
+        day = _parse_date(key) if in_calendar else None
+        if day:
+            for markup in value if isinstance(value, list) else [value]:
+                if isinstance(markup, str):
+                    yield from ((day, entry) for entry in _popup_entries(markup))
+        else:
+            yield from _calendar_days(value, in_calendar or key == "calendar")
+
+
+def parse_calendar(html: str) -> Dict[date, List[CalendarEntry]]:
+    """
+    Return the entries of the calendar of the cinema page `html`, by day.
+
+    The calendar (`#calendar`, rendered by jsCalendar) reads its events from the Drupal settings of the page, a JSON
+    script: under a `calendar` key, each day maps to the markup of its popup, the `#calendar-popup` list of links
+    the web browser scraper reads. Raise UnexpectedPageLayout if there is none, as the calendar always lists
+    at least a few weeks of shows.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    settings_script = soup.find("script", attrs={"data-drupal-selector": "drupal-settings-json"})
+    try:
+        settings = json.loads(settings_script.string or "") if settings_script else {}
+    except ValueError as e:
+        raise UnexpectedPageLayout(SERVICE_URL, f"invalid Drupal settings: {e}")
+
+    calendar = {}
+    for day, entry in _calendar_days(settings):
+        entries = calendar.setdefault(day, [])
+        if entry not in entries:
+            entries.append(entry)
+    if not calendar:
+        raise UnexpectedPageLayout(SERVICE_URL, "no calendar in the Drupal settings")
+    return dict(sorted(calendar.items()))
+
+
+def _request_deadline(deadline: Optional[float]) -> float:
+    return min(monotonic() + REQUEST_DEADLINE, deadline or float("inf"))
+
+
+def _fetch_calendar(deadline: Optional[float] = None) -> Dict[date, List[CalendarEntry]]:
+    if BESANCON_SCRAPER == "http":
+        try:
+            res = http_client.get(SERVICE_URL, deadline=_request_deadline(deadline))
+            if res.status_code != 200:
+                raise RemoteResourceException(SERVICE_URL, f"status code {res.status_code}")
+            return parse_calendar(res.text)
+        except (RemoteResourceException, UnexpectedPageLayout) as e:
+            print(f"{e} Falling back to the web browser...")
+
+    # imported here, so that selenium and a gecko driver are only needed when they are used
+    from cinema.cinemas_sources import besancon_browser
+
+    return besancon_browser.fetch_calendar()
+
+
+def _movie_fields(title: str, year: str = "", directors: str = "", **fields) -> dict:
+    """The FilmShow fields which only depend on the film, formatted as the Allociné ones."""
+    search_engines_query = quote_plus(f"{title} {year}".strip())
+    label = title + (f"<br>({year})" if year else "") + (f"<br>{directors}" if directors else "")
+    return {
+        "label": label,
+        "allocine_url": f"https://www.allocine.fr/rechercher/?q={search_engines_query}",
+        "yt_url": f"https://www.youtube.com/results?search_query=trailer+{search_engines_query}",
+        "sc_url": f"https://www.senscritique.com/search?query={search_engines_query}",
+        "rotten_tomatos_url": f"https://www.rottentomatoes.com/search?search={search_engines_query}",
+        "synopsis": fields.get("synopsis") or "Synopsis indisponible",
+        "tags": fields.get("tags", ""),
+        "poster_url": fields.get("poster_url", ""),
+        "runtime": fields.get("runtime", ""),
+    }
 
 
-def _get_web_element_of_current_day(driver, cur_day_int: int):
-    """Find the WebElement corresponding to the current day."""
+def _names(value) -> str:
+    """Names of schema.org persons or things, which may be a single one or a list."""
+    values = value if isinstance(value, list) else [value]
+    return ", ".join(item.get("name", "") if isinstance(item, dict) else str(item) for item in values if item)
 
-    cur_day_web_elements = driver.find_elements(By.XPATH, f"//*[@id='calendar']//td[text()='{cur_day_int}']")
-    if len(cur_day_web_elements) > 2:
-        raise Exception(
-            f"We fetched more than 2 days for the same day {cur_day_int}, this is bad, the HTML page has probably "
-            f"changed A LOT since the writing of this script."
-        )
-    elif len(cur_day_web_elements) == 2 and "jsCalendar-previous" in cur_day_web_elements[0].get_attribute("class"):
-        # we do have multiple days because we also fetched the day from the previous month, let's skip it and take
-        # the second one directly
-        return cur_day_web_elements[1]
 
-    return cur_day_web_elements[0]
+def _format_duration(value) -> str:
+    """ISO-8601 durations of schema.org, e.g. PT1H57M, formatted as Allociné runtimes: 1h 57min."""
+    match = re.fullmatch(r"PT(?:(\d+)H)?(?:(\d+)M)?(?:\d+S)?", value) if isinstance(value, str) else None
+    if not match or not any(match.groups()):
+        return ""
+    hours, minutes = int(match.group(1) or 0), int(match.group(2) or 0)
+    return f"{hours}h {minutes:02d}min" if hours else f"{minutes}min"
 
 
-def _get_calendar_header_element(soup, element: str) -> str:
-    calendar_div = soup.find("div", id="calendar")
-    table = calendar_div.find("table")
-    table_head = table.find("thead")
-    header = table_head.find_all("th")
-    for th in header:
-        calendar_title_div = th.find("div", class_=element)
-        if calendar_title_div:
-            return unidecode(calendar_title_div.text.strip().lower())
+def _find_movie(node) -> Optional[dict]:
+    """The schema.org Movie (or Event presenting one) of JSON-LD data."""
+    if isinstance(node, list):
+        return next(filter(None, map(_find_movie, node)), None)
+    if not isinstance(node, dict):
+        return None
+    if node.get("@type") in ("Movie", "ScreeningEvent", "Event"):
+        return _find_movie(node.get("workPresented")) or node
+    return _find_movie(node.get("@graph"))
 
 
-def _open_popup_and_get_current_day_content(driver, cur_day_web_element):
+def parse_details(html: str, title: str) -> dict:
     """
-    Emulate mouse hover to display the popup which displays details about this day.
-    Return a web element reference to the popup.
+    Return the film fields of the page `html` of a film, from its schema.org data and its OpenGraph metadata.
+    `title` is the one of the calendar, used if the page has none.
     """
-    actions = ActionChains(driver)
-    actions.move_to_element(cur_day_web_element).perform()
-    # wait for the popup to appear
-    time.sleep(0.1)
-    return driver.find_element(By.XPATH, "//*[@id='calendar-popup']")
-
-
-def _close_popup(driver):
-    calendar_elem = driver.find_element(By.XPATH, "//html")
-    actions = ActionChains(driver)
-    actions.move_to_element(calendar_elem).perform()
-    time.sleep(0.5)
-
-
-def _fetch_movies_from_the_current_month(driver, soup, cur_month: str) -> dict:
-    print(f"Fetching movies for {cur_month}...")
-    ret_movies = {}
-
-    calendar_div = soup.find("div", id="calendar")
-    table = calendar_div.find("table")
-    calendar_rows = table.find_all("tr")
-
-    # iterate over calendar table rows and columns to find td-days for the current month
-    for calendar_row in calendar_rows:
-        current_row_days = calendar_row.find_all("td")
-        for current_day in current_row_days:
-            if "jsCalendar-previous" in current_day.attrs.get("class", []):
-                # skipping days from the previous month
-                continue
-            if "jsCalendar-next" in current_day.attrs.get("class", []):
-                # we are now iterating over days from the next month
-                print(f"End of {cur_month}")
-                return ret_movies
-
-            if "has-events" not in current_day.attrs.get("class", []):
-                # skipping days with no movies events
-                continue
-
-            cur_day_int = int(current_day.text.strip())
-            cur_day_web_element = _get_web_element_of_current_day(driver, cur_day_int)
-
-            movies_popup = _open_popup_and_get_current_day_content(driver, cur_day_web_element)
-            for movie in movies_popup.find_elements(By.XPATH, "./ul/li"):
-                movie_element = movie.find_element(By.XPATH, "./a")
-                href_value = movie_element.get_attribute("href")
-                if not ret_movies.get(cur_month):
-                    ret_movies[cur_month] = {}
-                if not ret_movies[cur_month].get(cur_day_int):
-                    ret_movies[cur_month][cur_day_int] = []
-                ret_movies[cur_month][cur_day_int].append((movie_element.text, href_value))
-            _close_popup(driver)
-
-    return ret_movies
-
-
-def _load_next_month(driver):
-    """Load the next month in the calendar view. It triggers a js call."""
-    next_month_elem = driver.find_element(
-        By.XPATH, "//div[contains(@class, 'jsCalendar-title-right')]/div[contains(@class, 'jsCalendar-nav-right')]"
+    soup = BeautifulSoup(html, "html.parser")
+    movie = {}
+    for script in soup.find_all("script", type="application/ld+json"):
+        with suppress(ValueError):
+            movie = _find_movie(json.loads(script.string or "")) or movie
+
+    def meta(name: str) -> str:
+        tag = soup.find("meta", property=name) or soup.find("meta", attrs={"name": name})
+        return tag.get("content", "").strip() if tag else ""
+
+    heading = soup.find("h1")
+    image = movie.get("image")
+    poster_url = (image.get("url") if isinstance(image, dict) else image) or meta("og:image")
+    year = _DATE_RE.search(str(movie.get("dateCreated") or movie.get("datePublished") or ""))
+    return _movie_fields(
+        title=movie.get("name") or meta("og:title") or (heading.get_text(" ", strip=True) if heading else title),
+        year=(year.group(1) or year.group(6)) if year else "",
+        directors=_names(movie.get("director")),
+        synopsis=movie.get("description") or meta("og:description") or meta("description"),
+        tags=" / ".join(movie["genre"]) if isinstance(movie.get("genre"), list) else movie.get("genre", ""),
+        poster_url=urljoin(SERVICE_URL, poster_url) if poster_url else "",
+        runtime=_format_duration(movie.get("duration")),
     )
-    next_month_elem.click()
-    # parse the new page
-    soup = BeautifulSoup(driver.page_source, "html.parser")
-    return soup
 
 
-def _fetch_next_months_shows(driver, soup) -> dict:
+def _fetch_details(url: str, title: str, deadline: Optional[float] = None) -> dict:
     """
-    Get film shows from Cinemas Besançon.
+    Fetch the fields of the film of the page `url`. They are cached for DETAILS_CACHE_TTL,
+    and revalidated with a conditional request once expired.
+    If the page cannot be fetched, the fields are built from the calendar `title` only.
     """
-    current_month = _get_calendar_header_element(soup, "jsCalendar-title-name")
-    movies_result = _fetch_movies_from_the_current_month(driver, soup, current_month)
+    cache_entry = _details_cache.load("films", url) if HTTP_CACHE_ENABLED else None
+    if cache_entry and cache_entry.is_fresh(DETAILS_CACHE_TTL):
+        metrics.inc("cinema_cache_requests_total", cache="besancon_details", result="hit")
+        return cache_entry.payload
 
-    soup = _load_next_month(driver)
-
-    movies_result |= _fetch_movies_from_the_current_month(driver, soup, _get_next_month(current_month))
-    return movies_result
-
-
-def _next_seven_days() -> list[tuple[str, str]]:
-    """Returns the seven next days (month, index)."""
-    today = date.today()
-    next_7_days = []
-
-    for i in range(7):
-        next_day = today + timedelta(days=i)
-        month = next_day.strftime("%B")
-        day = str(int(next_day.strftime("%d")))
-        next_7_days.append((month, day))
-
-    return next_7_days
-
-
-def _fetch_details(driver, soup, url: str) -> FilmShow:
-    # fetch details from the page...!!
-    return FilmShow(url=url)
+    print(f"Fetching {title} details...")
+    try:
+        res = http_client.get(
+            url, deadline=_request_deadline(deadline), headers=cache_entry.validators() if cache_entry else None
+        )
+        if res.status_code == 304 and cache_entry:
+            metrics.inc("cinema_cache_requests_total", cache="besancon_details", result="revalidated")
+            _details_cache.touch("films", url, cache_entry)
+            return cache_entry.payload
+        if res.status_code != 200:
+            raise RemoteResourceException(url, f"status code {res.status_code}")
+    except RemoteResourceException as e:
+        print(e)
+        return _movie_fields(title)
+
+    details = parse_details(res.text, title)
+    if HTTP_CACHE_ENABLED:
+        metrics.inc("cinema_cache_requests_total", cache="besancon_details", result="miss")
+        _details_cache.store(
+            "films",
+            url,
+            CacheEntry(
+                payload=details,
+                fetched_at=time(),
+                etag=res.headers.get("ETag"),
+                last_modified=res.headers.get("Last-Modified"),
+            ),
+        )
+    return details
 
 
-def refine_shows_to_next_week_only(driver, soup, movies_result: dict) -> List[List[FilmShow]]:
-    shows = [[] for _ in range(7)]
+def _split_label(label: str) -> Tuple[str, str]:
+    """Split a calendar label, e.g. "18h15 The Big Lebowski", into its showtime, 18:15, and its title."""
+    match = re.match(r"(\d{1,2})h(\d{2})?\s+(.*)", label)
+    if not match:
+        return "", label
+    return f"{match.group(1)}:{match.group(2) or '00'}", match.group(3)
 
-    # for each show, scrap details
-    for idx, (month, day) in enumerate(_next_seven_days()):
-        if day not in movies_result[month]:
-            continue
 
-        for movie in movies_result[month][day]:
-            title, url = movie
-            print(f"Fetching {title} details...")
-            film_show = _fetch_details(driver, soup, url)
-            shows[idx].append(film_show)
+def refine_shows_to_next_week_only(
+    calendar: Dict[date, List[CalendarEntry]],
+    cinema_name: str,
+    first_day: Optional[date] = None,
+    days: int = 7,
+    concurrency: int = FETCH_CONCURRENCY,
+    deadline: Optional[float] = None,
+) -> List[List[FilmShow]]:
+    """
+    Build the FilmShow objects of the `days` days from `first_day` (today by default), one by film and day.
+    A film is usually shown on several days, so the details of each film are fetched only once,
+    concurrently with at most `concurrency` requests in flight.
+    """
+    first_day = first_day or date.today()
+    # showtimes of each film of each day, films of a day in their first show order
+    week = [{} for _ in range(days)]
+    titles = {}
+    for idx, day_showtimes in enumerate(week):
+        for label, url in calendar.get(first_day + timedelta(days=idx), []):
+            showtime, title = _split_label(label)
+            titles.setdefault(url, title)
+            day_showtimes.setdefault(url, []).append(showtime)
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        details = dict(zip(titles, executor.map(_fetch_details, titles, titles.values(), repeat(deadline))))
+
+    shows = []
+    for day_showtimes in week:
+        shows.append([])
+        for url, showtimes in day_showtimes.items():
+            fields = dict(details[url])
+            runtime = fields.pop("runtime") or "??"
+            shows[-1].append(
+                FilmShow(
+                    cinema=cinema_name,
+                    url=url,
+                    seances="<br>".join(sorted(filter(None, showtimes))) + f"<br><br>{runtime}",
+                    **fields,
+                )
+            )
 
     return shows
 
 
-def fetch_next_week_shows() -> List[List[FilmShow]]:
-    driver, soup = _init_web_browser()
-    # next_months_shows = _fetch_next_months_shows(driver, soup)
-    next_months_shows = {
-        "juin": {
-            "4": [
-                ["18h15 The Big Lebowski", "https://les2scenes.fr/cinema/big-lebowski"],
-                ["20h30 No Country for Old Men", "https://les2scenes.fr/cinema/no-country-old-men"],
-            ],
-            "5": [
-                ["16h The Big Lebowski", "https://les2scenes.fr/cinema/big-lebowski"],
-                [
-                    "18h15 La M\u00e8re de tous les mensonges",
-                    "https://les2scenes.fr/cinema/la-mere-de-tous-les-mensonges",
-                ],
-                ["20h30 Le Bleu du caftan", "https://les2scenes.fr/cinema/le-bleu-du-caftan"],
-            ],
-            "6": [
-                [
-                    "16h La M\u00e8re de tous les mensonges",
-                    "https://les2scenes.fr/cinema/la-mere-de-tous-les-mensonges",
-                ],
-                ["18h15 No Country for Old Men", "https://les2scenes.fr/cinema/no-country-old-men"],
-                ["20h30 The Big Lebowski", "https://les2scenes.fr/cinema/big-lebowski"],
-            ],
-            "7": [
-                ["16h Le Bleu du caftan", "https://les2scenes.fr/cinema/le-bleu-du-caftan"],
-                [
-                    "18h15 La M\u00e8re de tous les mensonges",
-                    "https://les2scenes.fr/cinema/la-mere-de-tous-les-mensonges",
-                ],
-                ["20h30 A Serious Man", "https://les2scenes.fr/cinema/serious-man"],
-            ],
-            "8": [
-                ["16h Menus-Plaisirs Les Troisgros", "https://les2scenes.fr/cinema/menus-plaisirs-les-troisgros"],
-                ["20h Caf\u00e9-cin\u00e9 | Juin 2024", "https://les2scenes.fr/cinema/cafe-cine-juin-2024"],
-            ],
-            "10": [
-                ["18h15 True Grit", "https://les2scenes.fr/cinema/true-grit"],
-                ["20h30 Animalia", "https://les2scenes.fr/cinema/animalia"],
-            ],
-            "11": [
-                ["16h Animalia", "https://les2scenes.fr/cinema/animalia"],
-                ["18h15 A Serious Man", "https://les2scenes.fr/cinema/serious-man"],
-                ["20h30 Inside Llewyn Davis", "https://les2scenes.fr/cinema/inside-llewyn-davis"],
-            ],
-            "13": [
-                ["18h15 The Big Lebowski", "https://les2scenes.fr/cinema/big-lebowski"],
-                ["20h30 No Country for Old Men", "https://les2scenes.fr/cinema/no-country-old-men"],
-            ],
-            "14": [
-                ["16h The Big Lebowski", "https://les2scenes.fr/cinema/big-lebowski"],
-                [
-                    "18h15 La M\u00e8re de tous les mensonges",
-                    "https://les2scenes.fr/cinema/la-mere-de-tous-les-mensonges",
-                ],
-                ["20h30 Le Bleu du caftan", "https://les2scenes.fr/cinema/le-bleu-du-caftan"],
-            ],
-            "15": [
-                ["16h The Big Lebowski", "https://les2scenes.fr/cinema/big-lebowski"],
-                [
-                    "18h15 La M\u00e8re de tous les mensonges",
-                    "https://les2scenes.fr/cinema/la-mere-de-tous-les-mensonges",
-                ],
-                ["20h30 Le Bleu du caftan", "https://les2scenes.fr/cinema/le-bleu-du-caftan"],
-            ],
-        },
-        "juillet": {
-            "3": [
-                ["18h Yannick", "https://les2scenes.fr/cinema/yannick"],
-                ["19h30 Caf\u00e9-cin\u00e9 | Juillet 2024", "https://les2scenes.fr/cinema/cafe-cine-juillet-2024"],
-                ["20h30 Yannick", "https://les2scenes.fr/cinema/yannick"],
-            ],
-            "8": [
-                ["14h Atelier Tremplin", "https://les2scenes.fr/cinema/atelier-tremplin"],
-                ["14h30 Ratatouille", "https://les2scenes.fr/cinema/ratatouille"],
-                ["18h Le Ch\u00e2teau dans le ciel", "https://les2scenes.fr/cinema/le-chateau-dans-le-ciel"],
-            ],
-            "9": [
-                ["14h Atelier Tremplin", "https://les2scenes.fr/cinema/atelier-tremplin"],
-                ["14h30 Mon ami robot", "https://les2scenes.fr/cinema/mon-ami-robot"],
-                ["18h Migration", "https://les2scenes.fr/cinema/migration"],
-            ],
-            "10": [
-                ["10h30 Un crocodile dans mon jardin", "https://les2scenes.fr/cinema/un-crocodile-dans-mon-jardin"],
-                ["14h Atelier Tremplin", "https://les2scenes.fr/cinema/atelier-tremplin"],
-                ["14h30 Le Ch\u00e2teau dans le ciel", "https://les2scenes.fr/cinema/le-chateau-dans-le-ciel"],
-                [
-                    "18h Courts m\u00e9trages de L'\u00c9t\u00e9 au cin\u00e9ma 2024",
-                    "https://les2scenes.fr/cinema/courts-metrages-de-lete-au-cinema-2024",
-                ],
-                ["18h Le Proc\u00e8s Goldman", "https://les2scenes.fr/cinema/le-proces-goldman"],
-                [
-                    "20h30 Courts m\u00e9trages de L'\u00c9t\u00e9 au cin\u00e9ma 2024",
-                    "https://les2scenes.fr/cinema/courts-metrages-de-lete-au-cinema-2024",
-                ],
-                ["20h30 Le Proc\u00e8s Goldman", "https://les2scenes.fr/cinema/le-proces-goldman"],
-            ],
-            "11": [
-                ["10h30 Les Tourouges et les Toubleus", "https://les2scenes.fr/cinema/les-tourouges-et-les-toubleus"],
-                ["14h Atelier Tremplin", "https://les2scenes.fr/cinema/atelier-tremplin"],
-                ["14h30 Migration", "https://les2scenes.fr/cinema/migration"],
-                ["18h Mon ami robot", "https://les2scenes.fr/cinema/mon-ami-robot"],
-            ],
-            "12": [
-                [
-                    "10h30 Le Petit Chat curieux (Komaneko)",
-                    "https://les2scenes.fr/cinema/le-petit-chat-curieux-komaneko",
-                ],
-                ["14h Atelier Tremplin", "https://les2scenes.fr/cinema/atelier-tremplin"],
-                ["18h Ratatouille", "https://les2scenes.fr/cinema/ratatouille"],
-            ],
-            "17": [
-                ["14h Atelier Tremplin", "https://les2scenes.fr/cinema/atelier-tremplin"],
-                ["14h30 Ratatouille", "https://les2scenes.fr/cinema/ratatouille"],
-                ["18h Le Ch\u00e2teau dans le ciel", "https://les2scenes.fr/cinema/le-chateau-dans-le-ciel"],
-            ],
-            "24": [
-                [
-                    "18h Courts m\u00e9trages de L'\u00c9t\u00e9 au cin\u00e9ma 2024",
-                    "https://les2scenes.fr/cinema/courts-metrages-de-lete-au-cinema-2024",
-                ],
-                ["18h Le R\u00e8gne animal", "https://les2scenes.fr/cinema/le-regne-animal"],
-                [
-                    "20h30 Courts m\u00e9trages de L'\u00c9t\u00e9 au cin\u00e9ma 2024",
-                    "https://les2scenes.fr/cinema/courts-metrages-de-lete-au-cinema-2024",
-                ],
-                ["20h30 Le R\u00e8gne animal", "https://les2scenes.fr/cinema/le-regne-animal"],
-            ],
-        },
-    }
-    next_week_shows = refine_shows_to_next_week_only(driver, soup, next_months_shows)
-    driver.quit()
-    return next_week_shows
+def fetch_next_week_shows(
+    cinemas: Dict[str, List[Cinema]],
+    days: int = 7,
+    concurrency: int = FETCH_CONCURRENCY,
+    deadline: Optional[float] = None,
+) -> Dict[str, List[List[FilmShow]]]:
+    """
+    Fetch shows from the calendar of les2scenes.fr for one week (or the given number of `days`), from today,
+    the requests ending by the `deadline` (a time.monotonic() timestamp).
+    Returns the shows by day of the city of VENUE (or else of the first cinema of the calendar), like
+    allocine.fetch_next_week_shows.
+    """
+    calendar_cinemas = [
+        cinema for city_cinemas in cinemas.values() for cinema in city_cinemas if cinema.website == SERVICE_URL
+    ]
+    if not calendar_cinemas:
+        return {}
+    cinema = next((cinema for cinema in calendar_cinemas if cinema.name == VENUE), calendar_cinemas[0])
+    other_names = [other.name for other in calendar_cinemas if other is not cinema]
+    if other_names:
+        print(f"The calendar does not tell the venue of its shows, none is given to {', '.join(other_names)}.")
+    shows = refine_shows_to_next_week_only(
+        _fetch_calendar(deadline), cinema.name, days=days, concurrency=concurrency, deadline=deadline
+    )
+    return {cinema.city: shows} if any(shows) else {}
@@ -16,3 +16,33 @@ class GeckoDriverNotFound(Exception):
 
     def __str__(self):
         return self.message
+
+
+class InvalidSnapshot(Exception):
+    message: str
+
+    def __init__(self, path, details: str):
+        self.message = f"Cannot load shows snapshot {path}: {details}."
+
+    def __str__(self):
+        return self.message
+
+
+class UnexpectedPageLayout(Exception):
+    message: str
+
+    def __init__(self, page: str, details: str):
+        self.message = f"Cannot scrape page {page}: {details}."
+
+    def __str__(self):
+        return self.message
+
+
+class SourceTimeout(Exception):
+    message: str
+
+    def __init__(self, source: str, budget: float):
+        self.message = f"Source {source} did not complete within its {budget:g}s time budget."
+
+    def __str__(self):
+        return self.message
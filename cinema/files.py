@@ -0,0 +1,83 @@
+import os
+from hashlib import sha256
+from pathlib import Path
+from shutil import chown
+from tempfile import NamedTemporaryFile
+from typing import List, Optional
+
+from cinema.settings import OUT_GROUP, OUT_USER
+
+
+def _temporary_file_for(path: Path):
+    return NamedTemporaryFile("wb", dir=path.parent, prefix=f".{path.name}.", suffix=".tmp", delete=False)
+
+
+def write_atomically(path: Path, content: bytes):
+    """Write to a temporary file then rename it, so that readers never see a partially written file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _temporary_file_for(path) as f:
+        f.write(content)
+    os.replace(f.name, path)
+
+
+def set_output_permissions(path: Path):
+    """Give a generated file or directory to the web server user."""
+    os.chmod(path, 0o755)
+    chown(path, OUT_USER, OUT_GROUP)
+
+
+def make_output_dirs(path: Path) -> List[Path]:
+    """Create `path` and its missing parents with the output permissions, return the created directories."""
+    created = []
+    while not path.is_dir():
+        created.insert(0, path)
+        path = path.parent
+    for directory in created:
+        directory.mkdir(exist_ok=True)
+        set_output_permissions(directory)
+    return created
+
+
+def _file_digest(path: Path) -> Optional[bytes]:
+    digest = sha256()
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(1 << 16):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.digest()
+
+
+class OutputFile:
+    """
+    A generated text file, written atomically and only if its content changed.
+
+    Content is streamed to a temporary file while being hashed. On exit, the temporary file replaces `path` only if
+    the hashes differ: unchanged files keep their mtime (and ETag), and the web server never serves a half-written
+    file. `changed` tells whether the file was (re)written.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.changed = False
+        self._digest = sha256()
+        self._tmp_file = None
+
+    def __enter__(self) -> "OutputFile":
+        self._tmp_file = _temporary_file_for(self.path)
+        return self
+
+    def write(self, text: str):
+        data = text.encode("utf-8")
+        self._digest.update(data)
+        self._tmp_file.write(data)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._tmp_file.close()
+        if exc_type is None and self._digest.digest() != _file_digest(self.path):
+            os.replace(self._tmp_file.name, self.path)
+            set_output_permissions(self.path)
+            self.changed = True
+        else:
+            os.unlink(self._tmp_file.name)
@@ -0,0 +1,86 @@
+"""
+Persistent on-disk cache for remote responses.
+
+Entries are JSON files grouped into buckets (e.g. one bucket per day of shows), so that a whole bucket can be
+evicted at once when it gets outdated. Entries remember the ETag/Last-Modified validators sent by the server,
+so that an expired entry can be revalidated with a conditional request instead of being downloaded again.
+"""
+
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from shutil import rmtree
+from time import time
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+
+from cinema.files import write_atomically
+
+
+# dry runs must not write anything: entries are still read, but never stored nor evicted
+_read_only = False
+
+
+def set_read_only(read_only: bool = True):
+    global _read_only
+    _read_only = read_only
+
+
+@dataclass
+class CacheEntry:
+    payload: Any
+    fetched_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # when this payload was received, unlike fetched_at it is kept when the entry is revalidated
+    stored_at: Optional[float] = None
+
+    def is_fresh(self, ttl: float) -> bool:
+        return time() - self.fetched_at < ttl
+
+    def unchanged_since(self, timestamp: Optional[float]) -> bool:
+        """Whether the payload is the same as at `timestamp`, as far as we know."""
+        return timestamp is not None and self.stored_at is not None and self.stored_at <= timestamp
+
+    def validators(self) -> Dict[str, str]:
+        """Headers to revalidate this entry with a conditional request."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    def __init__(self, directory: Path):
+        self.directory = directory
+
+    def _entry_path(self, bucket: str, key: str) -> Path:
+        return self.directory / bucket / f"{quote(key, safe='')}.json"
+
+    def load(self, bucket: str, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(self._entry_path(bucket, key)) as f:
+                return CacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            # missing or corrupted entry, it will be fetched again
+            return None
+
+    def store(self, bucket: str, key: str, entry: CacheEntry):
+        if _read_only:
+            return
+        write_atomically(self._entry_path(bucket, key), json.dumps(asdict(entry), separators=(",", ":")).encode())
+
+    def touch(self, bucket: str, key: str, entry: CacheEntry):
+        """Mark a revalidated entry as freshly fetched."""
+        entry.fetched_at = time()
+        self.store(bucket, key, entry)
+
+    def evict_buckets_before(self, oldest_bucket: str):
+        """Remove every bucket sorting before `oldest_bucket`, e.g. days in the past."""
+        if _read_only or not self.directory.is_dir():
+            return
+        for bucket_path in self.directory.iterdir():
+            if bucket_path.is_dir() and bucket_path.name < oldest_bucket:
+                rmtree(bucket_path, ignore_errors=True)
@@ -0,0 +1,158 @@
+"""
+Shared HTTP client used by every cinemas source.
+
+One `requests.Session` is kept for the whole process, so connections are kept alive and pooled per host,
+and transient failures (connection errors, 429 and 5xx responses) are retried with an exponential backoff.
+Requests may be given a deadline, which bounds their retries too.
+Requests to each host, retries included, are paced by its adaptive rate limiter (see rate_limit.py).
+"""
+
+from threading import Lock, local
+from time import monotonic, perf_counter, sleep
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+from cinema import metrics, rate_limit
+from cinema.exceptions import RemoteResourceException
+from cinema.settings import (
+    FETCH_CONCURRENCY,
+    HTTP_BACKOFF_FACTOR,
+    HTTP_BACKOFF_JITTER,
+    HTTP_POOL_SIZE,
+    HTTP_RETRIES,
+    HTTP_TIMEOUT,
+    RATE_LIMIT_ENABLED,
+)
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+_session: Optional[requests.Session] = None
+_session_lock = Lock()
+# kept-alive connections per host, see set_concurrency()
+_pool_size = max(HTTP_POOL_SIZE, FETCH_CONCURRENCY)
+# deadline and rate limiter of the request being sent by the current thread, read by the retries of the shared session
+_current_request = local()
+
+
+class _DeadlineRetry(Retry):
+    """
+    Retry which stops retrying, and waiting to retry, at the deadline of the current request.
+    Every throttling response, retried or not, slows down the rate limiter of the request, and retries wait for it.
+    """
+
+    @staticmethod
+    def _remaining() -> Optional[float]:
+        deadline = getattr(_current_request, "deadline", None)
+        return None if deadline is None else deadline - monotonic()
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        host_limiter = getattr(_current_request, "limiter", None)
+        if host_limiter and response is not None and response.status in rate_limit.THROTTLING_STATUSES:
+            host_limiter.throttled(response.status, self.get_retry_after(response))
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        remaining = self._remaining()
+        if remaining is not None and remaining <= 0:
+            raise MaxRetryError(_pool, url, error or "deadline exceeded")
+        return retry
+
+    def sleep(self, response=None):
+        remaining = self._remaining()
+        if remaining is None:
+            super().sleep(response)
+        else:
+            retry_after = self.get_retry_after(response) if self.respect_retry_after_header and response else None
+            sleep(max(min(self.get_backoff_time() if retry_after is None else retry_after, remaining), 0))
+        host_limiter = getattr(_current_request, "limiter", None)
+        if host_limiter and not host_limiter.acquire(getattr(_current_request, "deadline", None), new_request=False):
+            raise MaxRetryError(None, host_limiter.host, "deadline exceeded while rate limited")
+
+
+def _build_session() -> requests.Session:
+    retry = _DeadlineRetry(
+        total=HTTP_RETRIES,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=("GET", "HEAD"),
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        respect_retry_after_header=True,
+        # give the last response back to the caller instead of raising, sources know how to report it
+        raise_on_status=False,
+    )
+    # pool_maxsize is per host: it must allow as many connections as we have concurrent fetches
+    adapter = HTTPAdapter(pool_maxsize=_pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def set_concurrency(concurrency: int):
+    """
+    Allow `concurrency` requests in flight to a host (e.g. from --concurrency), in the connections pool and in the
+    rate limiters, instead of FETCH_CONCURRENCY.
+    """
+    global _session, _pool_size
+    with _session_lock:
+        _pool_size = max(HTTP_POOL_SIZE, concurrency)
+        # built on first use, with the pool size of that time
+        _session = None
+    rate_limit.set_max_in_flight(_pool_size)
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide HTTP session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _build_session()
+    return _session
+
+
+def get(url: str, deadline: Optional[float] = None, **kwargs) -> requests.Response:
+    """
+    GET `url` through the shared session, with the configured timeouts and retries.
+    With a `deadline` (a time.monotonic() timestamp), timeouts are shortened to the time left, and retries stop
+    once it has passed.
+    Raise RemoteResourceException when the resource stays unreachable after all retries.
+    """
+    host_limiter = rate_limit.limiter(urlsplit(url).hostname) if RATE_LIMIT_ENABLED else None
+    if host_limiter and not host_limiter.acquire(deadline):
+        raise RemoteResourceException(url, "deadline exceeded while rate limited")
+
+    status = None
+    try:
+        kwargs.setdefault("timeout", HTTP_TIMEOUT)
+        if deadline is not None:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise RemoteResourceException(url, "deadline exceeded")
+            connect_timeout, read_timeout = (
+                kwargs["timeout"] if isinstance(kwargs["timeout"], tuple) else (kwargs["timeout"], kwargs["timeout"])
+            )
+            kwargs["timeout"] = (min(connect_timeout, remaining), min(read_timeout, remaining))
+
+        start = perf_counter()
+        _current_request.deadline = deadline
+        _current_request.limiter = host_limiter
+        try:
+            res = get_session().get(url, **kwargs)
+        except requests.RequestException as e:
+            metrics.record_request(url, "error", perf_counter() - start, 0)
+            raise RemoteResourceException(url, str(e))
+        finally:
+            _current_request.deadline = None
+            _current_request.limiter = None
+        status = res.status_code
+        metrics.record_request(url, res.status_code, perf_counter() - start, len(res.content))
+        return res
+    finally:
+        if host_limiter:
+            # the latency of the last attempt, retries and their backoff are not the host's latency
+            host_limiter.release(status, res.elapsed.total_seconds() if status is not None else None)
@@ -1,13 +1,385 @@
-from cinema.cinemas_sources import allocine
-from cinema.models import load_cinemas
+import signal
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, time, timedelta
+from itertools import chain
+from pathlib import Path
+from shutil import rmtree
+from threading import Event
+from time import monotonic
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
 
-from cinema.output_generator import generate_html_files
+from cinema import cinemas_sources, http_cache, http_client, metrics, profiling, rate_limit, sharding
+from cinema.exceptions import InvalidSnapshot
+from cinema.models import Cinema, FilmShow, load_cinemas
+from cinema.output_generator import generate_html_files, write_shared_files
+from cinema.posters import evict_unreferenced_posters, localize_posters
+from cinema.server import PagesServer
+from cinema.settings import (
+    CACHE_PATH,
+    DAEMON_INTERVAL,
+    DAEMON_SHOWTIMES_CACHE_TTLS,
+    FETCH_CONCURRENCY,
+    OUT_PATH,
+    RUN_DEADLINE,
+    SERVER_PORT,
+    SHARDS_PATH,
+)
+from cinema.snapshot import Snapshot, merge_with_snapshot, save_snapshot
 
-if __name__ == "__main__":
-    cinemas = load_cinemas()
 
-    one_week_shows = allocine.fetch_next_week_shows(cinemas)
-    # one_week_shows = {}
-    # one_week_shows["Besançon"] = besancon_scraper.fetch_next_week_shows()  # fixme
+@contextmanager
+def _stage(name: str) -> Iterator[None]:
+    with metrics.stage(name), profiling.profile(name):
+        yield
+
+
+def _print_summary(one_week_shows: Mapping[str, List[List[FilmShow]]], first_day: date):
+    for city, city_one_week_shows in one_week_shows.items():
+        print(f"{city}:")
+        for day_index, day_shows in enumerate(city_one_week_shows):
+            print(f"  {(first_day + timedelta(days=day_index)).strftime('%A %d/%m')}: {len(day_shows)} shows")
+
+
+def fetch(
+    cinemas: Dict[str, List[Cinema]], args: Namespace, shard_path: Optional[Path] = None
+) -> Dict[str, List[List[FilmShow]]]:
+    """
+    Fetch shows of the selected cinemas and days, then save them to the snapshot,
+    completed with the snapshot shows of the cities and days which were not fetched.
+    A shard only saves its cities, to the snapshot of its `shard_path`, for the merge step.
+    """
+    deadline = monotonic() + args.deadline
+    with _stage("fetch"):
+        fresh_shows = cinemas_sources.fetch_next_week_shows(
+            cinemas, days=args.days, concurrency=args.concurrency, deadline=deadline
+        )
+    if args.dry_run:
+        _print_summary(fresh_shows, date.today())
+        return fresh_shows
+
+    with _stage("posters"):
+        localize_posters(
+            fresh_shows,
+            args.out,
+            args.concurrency,
+            download_missing=not args.no_posters,
+            # shards share the posters directory, the merge step adds their posters to its index
+            index_path=shard_path / sharding.POSTERS_INDEX_FILENAME if shard_path else None,
+            # posters which are not downloaded in time are retried by the next run, see allocine._reusable()
+            deadline=deadline,
+        )
+    rate_limit.save_limits()
+    with _stage("snapshot"):
+        one_week_shows = merge_with_snapshot(fresh_shows, cinemas, args.days)
+        if shard_path:
+            save_snapshot(
+                {city: one_week_shows[city] for city in cinemas if city in one_week_shows}, shard_path / "snapshot"
+            )
+        else:
+            save_snapshot(one_week_shows)
+    return one_week_shows
+
+
+def render(
+    cinemas: Dict[str, List[Cinema]],
+    selected_cinemas: Dict[str, List[Cinema]],
+    one_week_shows: Mapping[str, List[List[FilmShow]]],
+    first_day: date,
+    args: Namespace,
+    shard: bool = False,
+):
+    """
+    Generate the pages of the selected cities, pages of other cities are left untouched.
+    `one_week_shows` may be a Snapshot: only the selected cities are loaded to be rendered, and the pages of the ones
+    whose snapshot file cannot be read are left untouched.
+    A `shard` leaves the shared files and the posters eviction to the merge step, which knows every shard's posters.
+    """
+    selected_shows = {
+        city: shows for city in selected_cinemas if (shows := _readable_shows(one_week_shows, city)) is not None
+    }
+    if args.dry_run:
+        _print_summary(selected_shows, first_day)
+        return
+
+    with _stage("render"):
+        generate_html_files(cinemas, selected_shows, first_day=first_day, out_path=args.out, shared_files=not shard)
+        if not shard:
+            _evict_unreferenced_posters(one_week_shows, args)
+
+
+def _readable_shows(one_week_shows: Mapping[str, List[List[FilmShow]]], city: str) -> Optional[List[List[FilmShow]]]:
+    try:
+        return one_week_shows.get(city)
+    except InvalidSnapshot:
+        return None
+
+
+def _evict_unreferenced_posters(one_week_shows: Mapping[str, List[List[FilmShow]]], args: Namespace):
+    # posters are still referenced by pages of cities which were not rendered again
+    try:
+        poster_urls = [show.poster_url for show in chain.from_iterable(chain.from_iterable(one_week_shows.values()))]
+    except InvalidSnapshot:
+        print("Posters are not evicted, the pages of the cities which cannot be read may still use them.")
+        return
+    evict_unreferenced_posters(poster_urls, args.out / "pic")
+
+
+def run_shard(args: Namespace, shard_index: int):
+    """
+    Fetch and render the cities of one shard of the selected ones, in a worker process or on another machine.
+    Its snapshot and metrics are written to its directory of the work directory, for the merge step.
+    """
+    path = sharding.shard_path(args.workdir, shard_index, args.shards)
+    # left by a previous run which was not merged
+    rmtree(path, ignore_errors=True)
+    rate_limit.set_shard(args.shards, path / sharding.RATE_LIMITS_FILENAME)
+    success = False
+    try:
+        cinemas, selected_cinemas = _load_cinemas(args)
+        shard_cinemas = sharding.shard_cities(selected_cinemas, args.shards)[shard_index]
+        print(f"Shard {shard_index} of {args.shards}: {', '.join(shard_cinemas) or '-'}.")
+        one_week_shows = fetch(shard_cinemas, args, shard_path=path)
+        render(cinemas, shard_cinemas, one_week_shows, date.today(), args, shard=True)
+        success = True
+    finally:
+        metrics.write_metrics(success, textfile=None, json_path=path / "metrics.json")
+
+
+def merge(args: Namespace) -> bool:
+    """
+    Merge the shards of a sharded run, and write the files shared by every city.
+    Return False if some shards failed or are not done.
+    """
+    with _stage("merge"):
+        one_week_shows, not_merged = sharding.merge_shards(args.workdir, args.shards, args.out / "pic")
+        write_shared_files(args.out)
+        _evict_unreferenced_posters(one_week_shows, args)
+    return not not_merged
+
+
+def run_shards(args: Namespace) -> bool:
+    """Run every shard in its own process, then merge them. Return False if some shards failed."""
+    success = True
+    with ProcessPoolExecutor(max_workers=args.shards) as executor:
+        futures = [executor.submit(run_shard, args, shard_index) for shard_index in range(args.shards)]
+        for shard_index, future in enumerate(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Shard {shard_index} of {args.shards} failed: {e!r}")
+                success = False
+    # the shards which are done are merged even if others failed
+    return merge(args) and success
+
 
-    generate_html_files(cinemas, one_week_shows)
+def _seconds_until_next_refresh(interval: float) -> float:
+    """Refreshes happen every `interval`, and right after midnight so that pages start with the new day."""
+    now = datetime.now()
+    next_midnight = datetime.combine(now.date() + timedelta(days=1), time.min)
+    return min(interval, (next_midnight - now).total_seconds() + 1)
+
+
+def daemon(cinemas: Dict[str, List[Cinema]], selected_cinemas: Dict[str, List[Cinema]], args: Namespace):
+    """
+    Refresh the selected cities until SIGTERM or SIGINT, every DAEMON_INTERVAL. Days are fetched again as their
+    cached showtimes expire (see DAEMON_SHOWTIMES_CACHE_TTLS: today every hour, next days a few times a day, far days
+    once a day), and only the cities whose shows changed are rendered again.
+    The HTTP session, the templates and the posters store stay warm across refreshes.
+    With `--serve`, the pages are also served from memory, and replaced after each refresh which changed them.
+    """
+    # imported here, sources are only loaded when needed otherwise, see cinemas_sources
+    from cinema.cinemas_sources import allocine
+
+    allocine.set_showtimes_cache_ttls(DAEMON_SHOWTIMES_CACHE_TTLS)
+    stop = Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+    server: Optional[PagesServer] = None
+    if args.serve and not args.dry_run:
+        server = PagesServer(args.out, port=args.serve)
+        server.start()
+
+    rendered_shows: Dict[str, List[List[FilmShow]]] = {}
+    rendered_day = None
+    while not stop.is_set():
+        metrics.reset()
+        success = False
+        try:
+            today = date.today()
+            one_week_shows = fetch(selected_cinemas, args)
+            changed_cities = {
+                city: city_cinemas
+                for city, city_cinemas in selected_cinemas.items()
+                if today != rendered_day or one_week_shows.get(city) != rendered_shows.get(city)
+            }
+            if changed_cities:
+                render(cinemas, changed_cities, one_week_shows, today, args)
+                if server:
+                    server.load_pages()
+            print(f"{len(changed_cities)} cities changed: {', '.join(changed_cities) or '-'}.")
+            rendered_shows = {city: one_week_shows.get(city) for city in selected_cinemas}
+            rendered_day = today
+            success = True
+        except Exception as e:
+            # e.g. the network is down, the next refresh may succeed
+            print(f"Refresh failed: {e!r}")
+        finally:
+            if not args.dry_run:
+                metrics.write_metrics(success)
+        stop.wait(_seconds_until_next_refresh(args.interval))
+    if server:
+        server.stop()
+
+
+def _parse_args() -> Namespace:
+    parser = ArgumentParser(description="Fetch theaters shows and generate their web pages.")
+    parser.add_argument(
+        "stage",
+        nargs="?",
+        choices=("run", "fetch", "render", "daemon", "merge"),
+        default="run",
+        help="fetch shows to the snapshot, render pages from the snapshot, do both (default), keep doing both, "
+        "or merge the shards of a sharded run",
+    )
+    parser.add_argument(
+        "--cities", nargs="+", metavar="CITY", help="only fetch and render these cities (default: all of them)"
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        choices=range(1, 8),
+        default=7,
+        metavar="1-7",
+        help="only fetch this many days from today, following days are kept from the snapshot (default: 7)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=FETCH_CONCURRENCY,
+        help=f"max simultaneous requests to a source (default: {FETCH_CONCURRENCY})",
+    )
+    parser.add_argument("--no-posters", action="store_true", help="do not download missing posters")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print a summary of the shows instead of writing anything"
+    )
+    parser.add_argument("--out", type=Path, default=OUT_PATH, help=f"output directory (default: {OUT_PATH})")
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=RUN_DEADLINE,
+        metavar="SECONDS",
+        help=f"use the last known shows of what is not fetched within SECONDS (default: {RUN_DEADLINE:g})",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DAEMON_INTERVAL,
+        metavar="SECONDS",
+        help=f"seconds between two refreshes of the daemon (default: {DAEMON_INTERVAL:g})",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        nargs="?",
+        const=CACHE_PATH / "profiles",
+        metavar="DIR",
+        help=f"profile each stage and write the profiles to DIR (default: {CACHE_PATH / 'profiles'})",
+    )
+    parser.add_argument(
+        "--serve",
+        type=int,
+        nargs="?",
+        const=SERVER_PORT,
+        metavar="PORT",
+        help=f"daemon only, also serve the pages over HTTP on PORT (default: {SERVER_PORT})",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        metavar="N",
+        help="split the cities into N shards, fetched and rendered by as many processes, then merged (default: 1)",
+    )
+    parser.add_argument(
+        "--shard",
+        type=int,
+        metavar="INDEX",
+        help="only run the shard INDEX (0 to N-1) of --shards, e.g. on another machine, "
+        "then run the merge stage once every shard is done",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        default=SHARDS_PATH,
+        help=f"directory shared by the shards and the merge stage (default: {SHARDS_PATH})",
+    )
+    args = parser.parse_args()
+    if args.serve and args.stage != "daemon":
+        parser.error("--serve requires the daemon stage")
+    if args.shards < 1 or not 0 <= (args.shard or 0) < args.shards:
+        parser.error("--shards must be at least 1, and --shard between 0 and --shards - 1")
+    if (args.shards > 1 or args.shard is not None) and (args.stage not in ("run", "merge") or args.dry_run):
+        parser.error("sharded runs only support the run and merge stages, without --dry-run")
+    return args
+
+
+def _load_cinemas(args: Namespace) -> Tuple[Dict[str, List[Cinema]], Dict[str, List[Cinema]]]:
+    """Return all the cinemas, and the ones of the selected cities."""
+    with _stage("load_cinemas"):
+        cinemas = load_cinemas()
+    if not args.cities:
+        return cinemas, cinemas
+    unknown_cities = set(args.cities) - set(cinemas)
+    if unknown_cities:
+        raise SystemExit(f"Unknown cities: {', '.join(sorted(unknown_cities))}. Known: {', '.join(cinemas)}.")
+    return cinemas, {city: cinemas[city] for city in args.cities}
+
+
+def run(args: Namespace):
+    cinemas, selected_cinemas = _load_cinemas(args)
+
+    if args.stage == "render":
+        snapshot = Snapshot()
+        render(cinemas, selected_cinemas, snapshot, snapshot.first_day, args)
+        return
+
+    one_week_shows = fetch(selected_cinemas, args)
+    if args.stage == "run" and not args.dry_run:
+        render(cinemas, selected_cinemas, one_week_shows, date.today(), args)
+
+
+def main():
+    args = _parse_args()
+    if args.profile:
+        profiling.enable_profiling(args.profile)
+    http_client.set_concurrency(args.concurrency)
+    if args.dry_run:
+        http_cache.set_read_only()
+    if args.stage == "daemon":
+        # metrics are written after each refresh
+        daemon(*_load_cinemas(args), args)
+        return
+
+    if args.shard is not None and args.stage == "run":
+        # the metrics of a shard are written to its directory, the merge stage adds them to its own
+        run_shard(args, args.shard)
+        return
+
+    success = False
+    try:
+        if args.stage == "merge":
+            success = merge(args)
+        elif args.shards > 1:
+            success = run_shards(args)
+        else:
+            run(args)
+            success = True
+    finally:
+        if not args.dry_run:
+            metrics.write_metrics(success)
+
+
+if __name__ == "__main__":
+    main()
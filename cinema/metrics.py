@@ -0,0 +1,163 @@
+"""
+Metrics of a run: stages durations, HTTP requests, cache, posters and pages counts.
+
+They are written at the end of the run to a JSON summary, and to a node_exporter textfile (Prometheus text format)
+if METRICS_TEXTFILE is set, e.g. to /var/lib/prometheus/node-exporter/cinema.prom.
+"""
+
+import json
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from time import perf_counter, time
+from typing import Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from cinema.files import write_atomically
+from cinema.settings import METRICS_JSON, METRICS_TEXTFILE
+
+
+# name: (type, help); values are reset by every run and every refresh of the daemon, `_total` ones are counts of the
+# last run, hence gauges: as counters, Prometheus would take each reset for a restart
+METRICS = {
+    "cinema_last_run_timestamp_seconds": ("gauge", "End time of the last run."),
+    "cinema_last_run_success": ("gauge", "Whether the last run completed without error."),
+    "cinema_stage_duration_seconds": ("gauge", "Duration of each pipeline stage."),
+    "cinema_source_duration_seconds": ("gauge", "Duration of each shows source."),
+    "cinema_sources_total": ("gauge", "Shows sources of the last run by result (succeeded, failed)."),
+    "cinema_theater_days_total": (
+        "gauge",
+        "Theater days of the last run by source and result (fresh, reused, stale, missing).",
+    ),
+    "cinema_http_requests_total": ("gauge", "HTTP requests of the last run by host and status."),
+    "cinema_http_request_duration_seconds_total": ("gauge", "Cumulated HTTP requests latency of the last run by host."),
+    "cinema_http_request_duration_seconds_max": ("gauge", "Slowest HTTP request by host."),
+    "cinema_http_response_bytes_total": ("gauge", "HTTP responses bytes of the last run by host."),
+    "cinema_http_rate_limit": ("gauge", "Requests per second allowed by the adaptive rate limiter, by host."),
+    "cinema_http_max_in_flight": ("gauge", "Requests in flight allowed by the adaptive rate limiter, by host."),
+    "cinema_http_throttled_total": (
+        "gauge",
+        "Throttling responses of the last run by host and reason (429, 503, slow).",
+    ),
+    "cinema_cache_requests_total": (
+        "gauge",
+        "Cache lookups of the last run by cache and result (hit, revalidated, miss).",
+    ),
+    "cinema_posters_total": ("gauge", "Posters of the last run by result (downloaded, reused, failed)."),
+    "cinema_pages_total": ("gauge", "Generated pages of the last run by result (rewritten, unchanged)."),
+    "cinema_shards_total": ("gauge", "Shards of the last run by result (merged, failed, missing)."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_values: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+_lock = Lock()
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def reset():
+    """Forget the metrics recorded so far, e.g. between two refreshes of the daemon."""
+    with _lock:
+        _values.clear()
+
+
+def inc(name: str, value: float = 1, **labels):
+    key = _labels(labels)
+    with _lock:
+        _values[name][key] = _values[name].get(key, 0) + value
+
+
+def set_value(name: str, value: float, **labels):
+    with _lock:
+        _values[name][_labels(labels)] = value
+
+
+def set_max(name: str, value: float, **labels):
+    key = _labels(labels)
+    with _lock:
+        _values[name][key] = max(_values[name].get(key, value), value)
+
+
+# gauges summed by merge(), besides the `_total` counts: processes running at the same time share the rate of
+# requests to each host, see rate_limit.merge_limits()
+SUMMED_GAUGES = ("cinema_http_rate_limit", "cinema_http_max_in_flight")
+
+
+def merge(other_summary: dict):
+    """
+    Add the metrics of another process, e.g. a shard, as written by write_metrics(): `_total` counts and SUMMED_GAUGES
+    are summed, other gauges keep their highest value (stages durations become the ones of the slowest process).
+    """
+    for name, values in other_summary["metrics"].items():
+        summed = name.endswith("_total") or name in SUMMED_GAUGES
+        for value in values:
+            (inc if summed else set_max)(name, value["value"], **value["labels"])
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Record the duration of a pipeline stage."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        inc("cinema_stage_duration_seconds", perf_counter() - start, stage=name)
+
+
+def record_request(url: str, status: object, latency: float, size: int):
+    host = urlsplit(url).hostname
+    inc("cinema_http_requests_total", host=host, status=status)
+    inc("cinema_http_request_duration_seconds_total", latency, host=host)
+    set_max("cinema_http_request_duration_seconds_max", latency, host=host)
+    inc("cinema_http_response_bytes_total", size, host=host)
+
+
+def summary() -> dict:
+    """Metrics as a JSON-friendly dict, plus some ratios computed from them."""
+    with _lock:
+        values = {
+            name: [{"labels": dict(labels), "value": value} for labels, value in sorted(labels_values.items())]
+            for name, labels_values in _values.items()
+        }
+        cache_results = defaultdict(dict)
+        for labels, value in _values["cinema_cache_requests_total"].items():
+            labels = dict(labels)
+            cache_results[labels["cache"]][labels["result"]] = value
+    cache_hit_rates = {
+        # revalidated entries did not need to be downloaded again, they are hits too
+        cache: (results.get("hit", 0) + results.get("revalidated", 0)) / sum(results.values())
+        for cache, results in cache_results.items()
+    }
+    return {"metrics": values, "cache_hit_rates": cache_hit_rates}
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_text() -> str:
+    lines = []
+    with _lock:
+        for name, labels_values in sorted(_values.items()):
+            if not labels_values:
+                continue
+            metric_type, metric_help = METRICS.get(name, ("untyped", name))
+            lines += [f"# HELP {name} {metric_help}", f"# TYPE {name} {metric_type}"]
+            for labels, value in sorted(labels_values.items()):
+                labels_text = ",".join(f'{key}="{_escape(label_value)}"' for key, label_value in labels)
+                lines.append(f"{name}{{{labels_text}}} {value}" if labels_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(success: bool, textfile: Optional[Path] = METRICS_TEXTFILE, json_path: Path = METRICS_JSON):
+    """Write the metrics of the run, to be called once at its end, whether it failed or not."""
+    set_value("cinema_last_run_timestamp_seconds", time())
+    set_value("cinema_last_run_success", int(success))
+    if textfile:
+        # node_exporter may read the file at any time, it must never be seen partially written
+        write_atomically(textfile, _prometheus_text().encode())
+    write_atomically(json_path, json.dumps(summary(), indent=2).encode())
@@ -51,3 +51,5 @@ class FilmShow:
     url: str
     poster_url: str
     seances: str
+    # fetching failed, these are the last known shows of this cinema for this day
+    stale: bool = False
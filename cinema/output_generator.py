@@ -1,106 +1,191 @@
-from dataclasses import asdict
 from datetime import date, timedelta
-from os import chmod, makedirs
+from functools import lru_cache
+from itertools import chain
 from pathlib import Path
-from shutil import chown, copyfile, copytree
+from shutil import copyfile, copytree
 from string import Template
-from typing import TYPE_CHECKING, Dict, List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Mapping, Optional, Tuple
 
+from cinema import metrics
+from cinema.files import OutputFile, make_output_dirs, set_output_permissions
 from cinema.models import FilmShow
-from cinema.settings import HTML_TEMPLATES_PATH, MAIN_CITY, OUT_GROUP, OUT_PATH, OUT_USER, TEMPLATES
+from cinema.precompress import remove_outdated_siblings, write_compressed_siblings
+from cinema.settings import HTML_TEMPLATES_PATH, LAZY_DAYS, MAIN_CITY, OUT_PATH, PRECOMPRESS, TEMPLATES
 
 
 if TYPE_CHECKING:
     from cinema.models import Cinema
 
+# shown under the showtimes of stale shows, which could not be fetched again
+STALE_NOTE = "Horaires non mis à jour"
+
 
 def _normalize(city_name: str) -> str:
     return city_name.lower()
 
 
-def _set_permissions():
-    chmod(OUT_PATH, 0o755)
-    chown(OUT_PATH, OUT_USER, OUT_GROUP)
-
-    for path in sorted(OUT_PATH.rglob("*")):
-        chmod(path, 0o755)
-        chown(path, OUT_USER, OUT_GROUP)
-
-
-def _load_templates_files() -> Tuple[Template, Template, Template]:
-    with open(HTML_TEMPLATES_PATH / "row_one_movie.html") as template_file:
-        seance_template = Template(template_file.read())
-
-    with open(HTML_TEMPLATES_PATH / "table_one_day.html") as template_file:
-        daily_template = Template(template_file.read())
-
-    with open(HTML_TEMPLATES_PATH / "index.html") as template_file:
-        index_template = Template(template_file.read())
-
-    return index_template, daily_template, seance_template
-
-
-def _write_html_files_for_city(city: str, current_city_one_week_shows: List[List[FilmShow]], tab_other_cities: str):
-    index_template, daily_template, movie_row_template = _load_templates_files()
-    out_path = OUT_PATH / _normalize(city)
-    out_path.mkdir(parents=True, exist_ok=True)
-
-    table_html = ""
-    for day_index, movies_of_the_day in enumerate(current_city_one_week_shows):
-        daily_html = ""
-        for movie in movies_of_the_day:
-            daily_html += movie_row_template.substitute(asdict(movie))
-        table_html += daily_template.substitute(
-            DayNumber=day_index,
-            DayContent=daily_html,
-            Day=(date.today() + timedelta(days=day_index)).strftime("%A %d/%m"),
-            Checked=("Checked" if day_index == 0 else ""),
-            Hidden=(day_index != 0),
-            Selected=(day_index == 0),
-        )
-
-    with open(out_path / "index.html", "w+") as html_file:
-        html_file.write(index_template.substitute(TableContent=table_html, TabOtherCities=tab_other_cities))
+@lru_cache(maxsize=None)
+def _load_template(filename: str) -> Template:
+    """Load and compile a template once per process."""
+    with open(HTML_TEMPLATES_PATH / filename) as template_file:
+        return Template(template_file.read())
+
+
+@lru_cache(maxsize=None)
+def _load_split_template(filename: str, placeholder: str) -> Tuple[Template, Template]:
+    """
+    Load a template split around its `placeholder`, so that the (large) content of this placeholder
+    can be streamed between both parts instead of being substituted as a whole string.
+    """
+    with open(HTML_TEMPLATES_PATH / filename) as template_file:
+        head, tail = template_file.read().split(f"${placeholder}")
+    return Template(head), Template(tail)
+
+
+def _write_movie_rows(out_file: OutputFile, movies: List[FilmShow]):
+    movie_row_template = _load_template("row_one_movie.html")
+    for movie in movies:
+        values = vars(movie)
+        if movie.stale:
+            values = {**values, "seances": f"{movie.seances}<br><br><i>{STALE_NOTE}</i>"}
+        out_file.write(movie_row_template.substitute(values))
+
+
+def _write_day_fragment(out_path: Path, movies_of_the_day: List[FilmShow]) -> bool:
+    """Write the rows of one day in their own file, to be fetched when the day tab is opened."""
+    with OutputFile(out_path) as fragment_file:
+        _write_movie_rows(fragment_file, movies_of_the_day)
+    return fragment_file.changed
+
+
+def _write_html_files_for_city(
+    out_path: Path,
+    city: str,
+    current_city_one_week_shows: List[List[FilmShow]],
+    tab_other_cities: str,
+    first_day: date,
+    lazy_days: bool = LAZY_DAYS,
+) -> bool:
+    """
+    Write the index page of a city, return whether its content changed.
+    With `lazy_days`, only the first day is inlined in the page, other days are written as fragments
+    which are loaded when their tab is opened.
+    """
+    index_head, index_tail = _load_split_template("index.html", "TableContent")
+    daily_head, daily_tail = _load_split_template("table_one_day.html", "DayContent")
+    index_values = {
+        "TabOtherCities": tab_other_cities,
+        "Script": _load_template("lazy_days_script.html").template if lazy_days else "",
+    }
+    city_path = out_path / _normalize(city)
+    make_output_dirs(city_path)
+
+    fragments_changed = False
+    with OutputFile(city_path / "index.html") as html_file:
+        html_file.write(index_head.substitute(index_values))
+        for day_index, movies_of_the_day in enumerate(current_city_one_week_shows):
+            fragment_filename = f"day{day_index}.html" if lazy_days and day_index > 0 else None
+            day_values = {
+                "DayNumber": day_index,
+                "Day": (first_day + timedelta(days=day_index)).strftime("%A %d/%m"),
+                "Checked": ("Checked" if day_index == 0 else ""),
+                "Hidden": (day_index != 0),
+                "Selected": (day_index == 0),
+                "FragmentAttribute": f' data-fragment="{fragment_filename}"' if fragment_filename else "",
+            }
+            html_file.write(daily_head.substitute(day_values))
+            if fragment_filename:
+                fragments_changed |= _write_day_fragment(city_path / fragment_filename, movies_of_the_day)
+            else:
+                _write_movie_rows(html_file, movies_of_the_day)
+            html_file.write(daily_tail.substitute(day_values))
+        html_file.write(index_tail.substitute(index_values))
+    return html_file.changed or fragments_changed
 
 
 def _build_tab_other_cities(cinemas: dict) -> str:
-    with open(HTML_TEMPLATES_PATH / "row_one_city.html") as template_file:
-        city_template = Template(template_file.read())
-    tab = ""
-    for city_name, city_cinemas in cinemas.items():
-        tab += city_template.substitute(
+    city_template = _load_template("row_one_city.html")
+    return "".join(
+        city_template.substitute(
             NormalizedCity=_normalize(city_name),
             City=city_name,
             Cinemas=", ".join(cinema.serialize() for cinema in city_cinemas),
         )
-    return tab
+        for city_name, city_cinemas in cinemas.items()
+    )
 
 
-def _write_static_files_if_needed():
+def _write_static_files_if_needed(out_path: Path):
+    make_output_dirs(out_path / "pic")
     for ico_filename in ("allocine", "sc", "rottent", "yt"):
         ico_path = Path("pic") / (ico_filename + ".ico")
-        if not (OUT_PATH / ico_path).is_file():
-            copyfile((TEMPLATES / ico_path), (OUT_PATH / ico_path))
+        if not (out_path / ico_path).is_file():
+            copyfile((TEMPLATES / ico_path), (out_path / ico_path))
+            set_output_permissions(out_path / ico_path)
 
-    if "css" not in [d.name for d in OUT_PATH.iterdir()]:
-        copytree(TEMPLATES / "css", OUT_PATH / "css")
+    if not (out_path / "css").is_dir():
+        copytree(TEMPLATES / "css", out_path / "css")
+        for path in chain([out_path / "css"], (out_path / "css").rglob("*")):
+            set_output_permissions(path)
 
 
-def _write_root_index_file():
+def _write_root_index_file(out_path: Path) -> bool:
     """Write a root index which redirects to the MAIN_CITY index page."""
-    with open(OUT_PATH / "index.html", "w") as html_file:
-        with open(TEMPLATES / "html" / "root_index.html") as template_file:
-            root_index_template = Template(template_file.read())
-        html_file.write(root_index_template.substitute(mainCity=_normalize(MAIN_CITY)))
-
-
-def generate_html_files(cinemas: Dict[str, List["Cinema"]], one_week_shows: Dict[str, List[List[FilmShow]]]):
-    makedirs(OUT_PATH, exist_ok=True)
-
-    for city, current_city_one_week_shows in one_week_shows.items():
-        tab_other_cities = _build_tab_other_cities(cinemas)
-        _write_html_files_for_city(city, current_city_one_week_shows, tab_other_cities)
-
-    _write_root_index_file()
-    _write_static_files_if_needed()
-    _set_permissions()
+    with OutputFile(out_path / "index.html") as html_file:
+        html_file.write(_load_template("root_index.html").substitute(mainCity=_normalize(MAIN_CITY)))
+    return html_file.changed
+
+
+def generate_html_files(
+    cinemas: Dict[str, List["Cinema"]],
+    one_week_shows: Mapping[str, List[List[FilmShow]]],
+    first_day: Optional[date] = None,
+    out_path: Path = OUT_PATH,
+    shared_files: bool = True,
+):
+    """
+    Write the pages of every city of `one_week_shows`, and with `shared_files` the files shared by all of them
+    (see write_shared_files()). `first_day` is the day of the first list of shows, today by default.
+    Pages whose content did not change are left untouched.
+    """
+    make_output_dirs(out_path)
+
+    tab_other_cities = _build_tab_other_cities(cinemas)
+    rewritten_pages = [
+        city
+        for city, current_city_one_week_shows in one_week_shows.items()
+        if _write_html_files_for_city(
+            out_path, city, current_city_one_week_shows, tab_other_cities, first_day or date.today()
+        )
+    ]
+    print(f"{len(rewritten_pages)} city pages rewritten, {len(one_week_shows) - len(rewritten_pages)} unchanged.")
+    metrics.inc("cinema_pages_total", len(rewritten_pages), result="rewritten")
+    metrics.inc("cinema_pages_total", len(one_week_shows) - len(rewritten_pages), result="unchanged")
+
+    if shared_files:
+        _write_root_index_file(out_path)
+        _write_static_files_if_needed(out_path)
+    _update_compressed_siblings(
+        [path for city in one_week_shows for path in sorted((out_path / _normalize(city)).glob("*.html"))]
+        + (_shared_compressible_files(out_path) if shared_files else [])
+    )
+
+
+def _update_compressed_siblings(paths: List[Path]):
+    if PRECOMPRESS:
+        write_compressed_siblings(paths)
+    else:
+        # left by runs with PRECOMPRESS, they would be served instead of the pages rewritten since
+        remove_outdated_siblings(paths)
+
+
+def _shared_compressible_files(out_path: Path) -> List[Path]:
+    return [out_path / "index.html"] + sorted((out_path / "css").glob("*.css"))
+
+
+def write_shared_files(out_path: Path = OUT_PATH):
+    """Write the files shared by every city page: the root index, the stylesheets and the icons."""
+    make_output_dirs(out_path)
+    _write_root_index_file(out_path)
+    _write_static_files_if_needed(out_path)
+    _update_compressed_siblings(_shared_compressible_files(out_path))
@@ -0,0 +1,279 @@
+"""
+Posters pipeline: download the posters of a whole run concurrently, resize them to vignettes in a process pool,
+then store them in OUT_PATH/pic under a name derived from their URL.
+"""
+
+import json
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from hashlib import md5
+from io import BytesIO
+from itertools import chain, repeat
+from pathlib import Path
+from shutil import which
+from tempfile import NamedTemporaryFile
+from time import monotonic, time
+from typing import Dict, Iterable, List, Optional, Set
+
+from cinema import http_client, metrics
+from cinema.exceptions import RemoteResourceException
+from cinema.files import make_output_dirs, set_output_permissions, write_atomically
+from cinema.models import FilmShow
+from cinema.settings import (
+    COMPRESS_PIC,
+    FETCH_CONCURRENCY,
+    OUT_PATH,
+    POSTERS_MAX_BYTES,
+    POSTERS_MAX_FILES,
+    REQUEST_DEADLINE,
+)
+
+
+try:
+    from PIL import Image
+except ImportError:
+    # without Pillow, posters are resized with ImageMagick if available, or kept as is
+    Image = None
+
+
+POSTER_SIZE = (120, 160)
+
+
+def poster_filename(url: str) -> str:
+    return f"{md5(url.encode()).hexdigest()}{Path(url).suffix}"
+
+
+def _download(url: str, deadline: Optional[float] = None) -> Optional[bytes]:
+    """Download a poster within REQUEST_DEADLINE and the run `deadline`, None if it fails or the deadline passed."""
+    if deadline is not None and monotonic() >= deadline:
+        return None
+    try:
+        res = http_client.get(url, deadline=min(monotonic() + REQUEST_DEADLINE, deadline or float("inf")))
+    except RemoteResourceException as e:
+        print(e)
+        return None
+    if not (200 <= res.status_code < 300):
+        print(f"Exception downloading {url}.")
+        return None
+    return res.content
+
+
+def _resize_with_pillow(pic_bytes: bytes) -> bytes:
+    with Image.open(BytesIO(pic_bytes)) as image:
+        image_format = image.format
+        image.thumbnail(POSTER_SIZE)
+        out = BytesIO()
+        image.save(out, format=image_format, quality=90)
+    return out.getvalue()
+
+
+def _resize_with_imagemagick(pic_bytes: bytes, file_extension: str) -> bytes:
+    with NamedTemporaryFile(suffix=file_extension) as f:
+        f.write(pic_bytes)
+        f.flush()
+        if subprocess.call(["convert", f.name, "-resize", "x".join(map(str, POSTER_SIZE)), f.name]):
+            raise OSError("convert failed")
+        return Path(f.name).read_bytes()
+
+
+def _resize(url: str, pic_bytes: bytes) -> bytes:
+    """Resize a poster to fit in POSTER_SIZE, keeping its format. Runs in a worker process."""
+    try:
+        if Image is not None:
+            return _resize_with_pillow(pic_bytes)
+        return _resize_with_imagemagick(pic_bytes, Path(url).suffix)
+    except Exception as e:  # a corrupted picture must not break the run, keep it as is
+        print(f"Exception during resizing of {url}: {e}")
+        return pic_bytes
+
+
+def _resize_all(downloaded: Dict[str, bytes]) -> Dict[str, bytes]:
+    if not COMPRESS_PIC or not downloaded:
+        return downloaded
+    if Image is None and not which("convert"):
+        print("Neither Pillow nor ImageMagick is installed, posters are kept at their original size.")
+        return downloaded
+
+    with ProcessPoolExecutor() as executor:
+        return dict(zip(downloaded, executor.map(_resize, downloaded.keys(), downloaded.values())))
+
+
+class PosterStore:
+    """
+    The posters stored in OUT_PATH/pic, bounded in size.
+
+    An index file records the size and the last time each poster was referenced by a run, so that knowing
+    which posters exist and which ones to evict does not require to stat the whole directory.
+    Files which are not posters, such as the static icons, are never indexed hence never evicted.
+    """
+
+    INDEX_FILENAME = ".posters_index.json"
+
+    def __init__(self, directory: Path, max_bytes: int = POSTERS_MAX_BYTES, max_files: int = POSTERS_MAX_FILES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.index_path = directory / self.INDEX_FILENAME
+        self.index = self._load_index()
+
+    def _load_index(self) -> Dict[str, dict]:
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self._build_index()
+        except ValueError:
+            print(f"Corrupted {self.index_path}, rebuilding it.")
+            return self._build_index()
+
+    def _build_index(self) -> Dict[str, dict]:
+        """Index the posters already on disk, e.g. the first time the store is used on an existing OUT_PATH."""
+        index = {}
+        if self.directory.is_dir():
+            for path in self.directory.iterdir():
+                if path.is_file() and path.suffix not in (".ico", ".json", ".tmp"):
+                    stat = path.stat()
+                    index[path.name] = {"size": stat.st_size, "last_used": stat.st_mtime}
+        return index
+
+    def save(self, index_path: Optional[Path] = None):
+        """Save the index, to `index_path` instead of the directory if given, e.g. by a shard, see merge_indexes()."""
+        write_atomically(index_path or self.index_path, json.dumps(self.index, separators=(",", ":")).encode())
+
+    def merge_index(self, index_path: Path):
+        """Add the posters of the index saved at `index_path`, keeping the last use of each one."""
+        try:
+            index = json.loads(index_path.read_text())
+        except (OSError, ValueError):
+            # not saved, e.g. the shard failed before storing its posters
+            return
+        for filename, entry in index.items():
+            if filename not in self.index or entry["last_used"] > self.index[filename]["last_used"]:
+                self.index[filename] = entry
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self.index
+
+    def add(self, filename: str, content: bytes):
+        make_output_dirs(self.directory)
+        write_atomically(self.directory / filename, content)
+        set_output_permissions(self.directory / filename)
+        self.index[filename] = {"size": len(content), "last_used": time()}
+
+    def touch(self, filenames: Iterable[str]):
+        now = time()
+        for filename in filenames:
+            if filename in self.index:
+                self.index[filename]["last_used"] = now
+
+    def evict(self, referenced_filenames: Set[str]):
+        """
+        Delete posters which are not referenced any more, least recently used first,
+        until the store fits in its bounds again. Referenced posters are never deleted.
+        """
+        total_bytes = sum(entry["size"] for entry in self.index.values())
+        total_files = len(self.index)
+        unreferenced = sorted(
+            (filename for filename in self.index if filename not in referenced_filenames),
+            key=lambda filename: self.index[filename]["last_used"],
+        )
+        for filename in unreferenced:
+            if total_bytes <= self.max_bytes and total_files <= self.max_files:
+                break
+            (self.directory / filename).unlink(missing_ok=True)
+            total_bytes -= self.index.pop(filename)["size"]
+            total_files -= 1
+
+
+@lru_cache(maxsize=None)
+def _poster_store(pic_directory: Path) -> PosterStore:
+    """The store of `pic_directory`, loaded once per process, e.g. once for all the refreshes of the daemon."""
+    return PosterStore(pic_directory)
+
+
+def download_posters(
+    urls: Iterable[str],
+    pic_directory: Path = OUT_PATH / "pic",
+    concurrency: int = FETCH_CONCURRENCY,
+    download_missing: bool = True,
+    index_path: Optional[Path] = None,
+    deadline: Optional[float] = None,
+) -> Dict[str, str]:
+    """
+    Download the given posters, if not already done, and return the relative path to each of them by URL.
+    Posters which cannot be downloaded, or are missing when `download_missing` is False, are missing from the
+    returned dict.
+    Downloads which are not done by the `deadline` (a time.monotonic() timestamp) are given up, their posters are
+    missing too.
+    The index of the store is saved to `index_path` if given, see merge_indexes().
+    Note: some films (too old, foreign countries) do not have posters, empty URLs are ignored.
+    """
+    store = _poster_store(pic_directory)
+
+    unique_urls = sorted({url for url in urls if url})
+    missing_urls = [url for url in unique_urls if poster_filename(url) not in store] if download_missing else []
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        pics = executor.map(_download, missing_urls, repeat(deadline))
+        downloaded = {url: pic for url, pic in zip(missing_urls, pics) if pic}
+
+    for url, pic_bytes in _resize_all(downloaded).items():
+        store.add(poster_filename(url), pic_bytes)
+    metrics.inc("cinema_posters_total", len(downloaded), result="downloaded")
+    metrics.inc("cinema_posters_total", len(missing_urls) - len(downloaded), result="failed")
+    metrics.inc("cinema_posters_total", len(unique_urls) - len(missing_urls), result="reused")
+
+    poster_paths = {url: poster_filename(url) for url in unique_urls if poster_filename(url) in store}
+    store.touch(poster_paths.values())
+    store.save(index_path)
+    return {url: f"../pic/{filename}" for url, filename in poster_paths.items()}
+
+
+def localize_posters(
+    one_week_shows: Dict[str, List[List[FilmShow]]],
+    out_path: Path = OUT_PATH,
+    concurrency: int = FETCH_CONCURRENCY,
+    download_missing: bool = True,
+    index_path: Optional[Path] = None,
+    deadline: Optional[float] = None,
+):
+    """
+    Replace the remote poster URL of every show by the relative path to its local copy, see download_posters,
+    or None if it could not be downloaded by the `deadline`. Shows without any poster keep their empty URL.
+    """
+    # stale shows of the snapshot already point to their local copy
+    shows = [
+        show
+        for show in chain.from_iterable(chain.from_iterable(one_week_shows.values()))
+        if not show.poster_url or "://" in show.poster_url
+    ]
+    poster_paths = download_posters(
+        (show.poster_url for show in shows),
+        out_path / "pic",
+        concurrency,
+        download_missing=download_missing,
+        index_path=index_path,
+        deadline=deadline,
+    )
+    for show in shows:
+        if show.poster_url:
+            show.poster_url = poster_paths.get(show.poster_url)
+
+
+def evict_unreferenced_posters(referenced_paths: Iterable[Optional[str]], pic_directory: Path = OUT_PATH / "pic"):
+    """Evict the posters which are not referenced by `referenced_paths`, as returned by download_posters."""
+    store = _poster_store(pic_directory)
+    store.evict({Path(path).name for path in referenced_paths if path})
+    store.save()
+
+
+def merge_indexes(index_paths: Iterable[Path], pic_directory: Path = OUT_PATH / "pic"):
+    """
+    Add the posters indexes saved by the shards of a run to the one of `pic_directory`: shards share the directory,
+    but saving its index concurrently would lose the posters of all of them but the last one.
+    """
+    store = _poster_store(pic_directory)
+    for index_path in index_paths:
+        store.merge_index(index_path)
+    store.save()
@@ -0,0 +1,84 @@
+"""
+Precompressed siblings of the generated files (`index.html.gz`, `index.html.br`...),
+to be served as is by nginx `gzip_static`/`brotli_static` instead of being compressed on every request.
+"""
+
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable
+
+from cinema.files import set_output_permissions, write_atomically
+
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        # brotli is optional, only gzip siblings are generated without it
+        brotli = None
+
+
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    # mtime=0 makes the output only depend on the content
+    ".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+}
+if brotli is not None:
+    COMPRESSORS[".br"] = lambda data: brotli.compress(data, quality=11)
+# every extension this module may have written, including the ones of compressors which are not available any more
+SIBLINGS_EXTENSIONS = (".gz", ".br")
+
+
+def _remove_outdated_siblings(path: Path, extensions: Iterable[str]) -> int:
+    """Remove the siblings of `path` with these extensions whose source changed since, return how many were removed."""
+    removed = 0
+    source_mtime_ns = path.stat().st_mtime_ns if path.is_file() else None
+    for extension in extensions:
+        sibling = path.with_name(path.name + extension)
+        if sibling.is_file() and sibling.stat().st_mtime_ns != source_mtime_ns:
+            sibling.unlink()
+            removed += 1
+    return removed
+
+
+def _write_compressed_siblings(path: Path) -> int:
+    """Write the outdated compressed siblings of `path`, return how many were written."""
+    # e.g. .br siblings once brotli was uninstalled, nginx would keep serving them
+    _remove_outdated_siblings(path, (extension for extension in SIBLINGS_EXTENSIONS if extension not in COMPRESSORS))
+    source_mtime_ns = path.stat().st_mtime_ns
+    outdated_siblings = {}
+    for extension, compress in COMPRESSORS.items():
+        sibling = path.with_name(path.name + extension)
+        # siblings get the mtime of their source, a different mtime means the source changed since
+        if not sibling.is_file() or sibling.stat().st_mtime_ns != source_mtime_ns:
+            outdated_siblings[sibling] = compress
+    if not outdated_siblings:
+        return 0
+
+    data = path.read_bytes()
+    for sibling, compress in outdated_siblings.items():
+        write_atomically(sibling, compress(data))
+        os.utime(sibling, ns=(source_mtime_ns, source_mtime_ns))
+        set_output_permissions(sibling)
+    return len(outdated_siblings)
+
+
+def write_compressed_siblings(paths: Iterable[Path]):
+    """Write in parallel the compressed siblings of `paths` whose source changed since they were written."""
+    # zlib and brotli release the GIL while compressing, threads are enough to use every core
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        written = sum(executor.map(_write_compressed_siblings, paths))
+    print(f"{written} compressed files written.")
+
+
+def remove_outdated_siblings(paths: Iterable[Path]):
+    """
+    Remove the compressed siblings of `paths` whose source changed since they were written, e.g. when PRECOMPRESS
+    was disabled: nginx `gzip_static` would keep serving them instead of their newer source.
+    """
+    removed = sum(_remove_outdated_siblings(path, SIBLINGS_EXTENSIONS) for path in paths)
+    if removed:
+        print(f"{removed} outdated compressed files removed.")
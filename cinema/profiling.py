@@ -0,0 +1,126 @@
+"""
+Per-stage profiling, enabled with `main.py --profile` or the CINEMA_PROFILE environment variable.
+
+Each stage dumps to the profiles directory:
+- `<stage>.pstats`, to be explored with pstats or snakeviz,
+- `<stage>.collapsed`, collapsed stacks for flamegraph.pl or speedscope,
+- `<stage>.txt`, the top hotspots overall and in our own code, which is also printed.
+When profiling is disabled, it costs a single check per stage.
+"""
+
+import cProfile
+import io
+import pstats
+import re
+import sys
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from cinema.files import write_atomically
+from cinema.settings import PROFILE_PATH
+
+
+TOP_N = 15
+CODE_PATH = Path(__file__).resolve().parent
+# collapsed stacks branches getting less than this many seconds are dropped, it keeps their number bounded
+MIN_STACK_TIME = 1e-6
+
+_profile_path: Optional[Path] = PROFILE_PATH
+
+
+def enable_profiling(profile_path: Path):
+    global _profile_path
+    _profile_path = profile_path
+
+
+def _profile_new_threads(profilers: list):
+    """Profile the threads started from now on, e.g. by thread pools. Before 3.12, a profiler only sees its thread."""
+
+    def start_thread_profiler(*_):
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+
+    threading.setprofile(start_thread_profiler)
+
+
+def _func_label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    return f"{Path(filename).name}:{line}({name})" if line else name
+
+
+def _caller_paths(stats: dict, func, time: float, seen: frozenset) -> Iterator[Tuple[tuple, float]]:
+    """Split `time` spent in `func` across its callers paths, proportionally to the time each caller spent in it."""
+    callers = stats[func][4]
+    total_time = sum(edge[3] for edge in callers.values())
+    if not callers or func in seen or not total_time:
+        yield (func,), time
+        return
+    for caller, edge in callers.items():
+        caller_time = time * edge[3] / total_time
+        if caller_time >= MIN_STACK_TIME:
+            for path, path_time in _caller_paths(stats, caller, caller_time, seen | {func}):
+                yield path + (func,), path_time
+
+
+def _collapsed_stacks(stats: pstats.Stats) -> str:
+    """
+    Collapsed stacks approximated from the profile call graph: cProfile only records caller→callee edges,
+    so the self time of a function is split across its callers paths proportionally to the time spent by each.
+    """
+    stacks: Dict[tuple, float] = defaultdict(float)
+    for func, (_, _, self_time, _, callers) in stats.stats.items():
+        if not callers:
+            stacks[(func,)] += self_time
+        for caller, edge in callers.items():
+            # edge[2] is the self time of func when called by caller
+            for path, path_time in _caller_paths(stats.stats, caller, edge[2], frozenset({func})):
+                stacks[path + (func,)] += path_time
+    return "".join(
+        f"{';'.join(_func_label(func) for func in path)} {round(time * 1e6)}\n"
+        for path, time in sorted(stacks.items())
+        if round(time * 1e6)
+    )
+
+
+def _hotspots(stats: pstats.Stats) -> str:
+    out = io.StringIO()
+    stats.stream = out
+    print("Top functions by own time:", file=out)
+    stats.sort_stats(pstats.SortKey.TIME).print_stats(TOP_N)
+    print("Top functions of our own code by cumulated time:", file=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(re.escape(str(CODE_PATH)), TOP_N)
+    return out.getvalue()
+
+
+def _dump(stage: str, profilers: list):
+    stats = pstats.Stats(*profilers)
+    _profile_path.mkdir(parents=True, exist_ok=True)
+    stats.dump_stats(_profile_path / f"{stage}.pstats")
+    write_atomically(_profile_path / f"{stage}.collapsed", _collapsed_stacks(stats).encode())
+    hotspots = _hotspots(stats)
+    write_atomically(_profile_path / f"{stage}.txt", hotspots.encode())
+    print(f"Profile of {stage} written to {_profile_path}/{stage}.*\n{hotspots}")
+
+
+@contextmanager
+def profile(stage: str) -> Iterator[None]:
+    """Profile a pipeline stage, including the threads it starts, if profiling is enabled."""
+    if _profile_path is None:
+        yield
+        return
+
+    profilers = [cProfile.Profile()]
+    if sys.version_info < (3, 12):
+        _profile_new_threads(profilers)
+    profilers[0].enable()
+    try:
+        yield
+    finally:
+        profilers[0].disable()
+        threading.setprofile(None)
+        _dump(stage, profilers)
@@ -0,0 +1,224 @@
+"""
+Adaptive rate limiting of the requests to each host, shared by every source through http_client.py.
+
+Each host gets a token bucket, plus a limit of requests in flight. Both grow slowly after fast successful responses,
+and are halved on 429 or 503 responses, or when a response is much slower than usual (AIMD, as the TCP congestion
+control does). A `Retry-After` header pauses every request to the host.
+The learned rates are saved after each fetch, so that the next run starts at the rate the host tolerated.
+The shards of a sharded run share these rates: each one starts at its share, and the merge step adds them up.
+"""
+
+import json
+from pathlib import Path
+from threading import Condition, Lock
+from time import monotonic
+from typing import Dict, Iterable, Optional
+
+from cinema import metrics
+from cinema.files import write_atomically
+from cinema.settings import FETCH_CONCURRENCY, HTTP_POOL_SIZE, RATE_LIMIT_BOUNDS, RATE_LIMIT_INITIAL, RATE_LIMITS_PATH
+
+
+THROTTLING_STATUSES = (429, 503)
+RATE_INCREASE = 0.5  # requests per second gained per second of fast successful responses
+DECREASE_FACTOR = 0.5
+SLOW_RESPONSE_FACTOR = 3  # a response this many times slower than the average one means the host is overloaded
+MIN_SLOW_RESPONSE = 1.0  # seconds under which a response is never considered slow
+LATENCY_SMOOTHING = 0.2  # weight of the last response in the average latency
+MAX_RETRY_AFTER = 120  # seconds, longer pauses are left to the retries backoff and deadlines
+
+
+class HostRateLimiter:
+    """Token bucket and limit of requests in flight to one host, adapted to its responses."""
+
+    def __init__(
+        self,
+        host: str,
+        rate: float = RATE_LIMIT_INITIAL,
+        max_in_flight: float = 2,
+        max_rate: float = RATE_LIMIT_BOUNDS[1],
+    ):
+        self.host = host
+        self.rate = rate  # requests per second
+        self.max_in_flight = max_in_flight
+        self.max_rate = max_rate
+        self._tokens = 1.0
+        self._refilled_at = monotonic()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._latency: Optional[float] = None
+        self._decreased_at = 0.0
+        self._condition = Condition()
+
+    def _refill(self, now: float):
+        # a burst of up to one second of requests is allowed
+        self._tokens = min(self._tokens + (now - self._refilled_at) * self.rate, max(self.rate, 1))
+        self._refilled_at = now
+
+    def acquire(self, deadline: Optional[float] = None, new_request: bool = True) -> bool:
+        """
+        Wait for a token, and a free slot for a `new_request` (retries keep the slot of their request).
+        Return False if the `deadline` (a time.monotonic() timestamp) passes first.
+        """
+        with self._condition:
+            while True:
+                now = monotonic()
+                self._refill(now)
+                slot_free = not new_request or self._in_flight < int(self.max_in_flight)
+                if slot_free and self._tokens >= 1 and now >= self._paused_until:
+                    self._tokens -= 1
+                    self._in_flight += new_request
+                    return True
+
+                waits = []
+                if now < self._paused_until:
+                    waits.append(self._paused_until - now)
+                if self._tokens < 1:
+                    waits.append((1 - self._tokens) / self.rate)
+                # without any, only a slot is missing, release() notifies when one is freed
+                wait = max(waits) if waits else None
+                if deadline is not None:
+                    if deadline <= now:
+                        return False
+                    wait = min(wait or deadline - now, deadline - now)
+                self._condition.wait(wait)
+
+    def release(self, status: Optional[int] = None, latency: Optional[float] = None):
+        """Free the slot of a request, and adapt the rate to its response, None if it failed."""
+        with self._condition:
+            self._in_flight -= 1
+            if status is not None and status < 400 and latency is not None:
+                if self._latency is not None and latency > max(SLOW_RESPONSE_FACTOR * self._latency, MIN_SLOW_RESPONSE):
+                    self._decrease("slow")
+                else:
+                    self._increase()
+                    self._latency = (
+                        latency
+                        if self._latency is None
+                        else LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self._latency
+                    )
+            self._condition.notify_all()
+
+    def throttled(self, status: int, retry_after: Optional[float] = None):
+        """Slow down after a throttling response, and pause the host for `retry_after` seconds."""
+        with self._condition:
+            self._decrease(str(status))
+            if retry_after:
+                self._paused_until = max(self._paused_until, monotonic() + min(retry_after, MAX_RETRY_AFTER))
+
+    def _increase(self):
+        # additive: about RATE_INCREASE more requests per second every second, one more request in flight per
+        # max_in_flight successful ones
+        self.rate = min(self.rate + RATE_INCREASE / self.rate, self.max_rate)
+        self.max_in_flight = min(self.max_in_flight + 1 / self.max_in_flight, _max_in_flight)
+        self._record_metrics()
+
+    def _decrease(self, reason: str):
+        metrics.inc("cinema_http_throttled_total", host=self.host, reason=reason)
+        now = monotonic()
+        # the responses to requests sent at the previous rate are still coming, they must not halve it again
+        if now - self._decreased_at < max(2 * (self._latency or 0), 1):
+            return
+        self._decreased_at = now
+        self.rate = max(self.rate * DECREASE_FACTOR, RATE_LIMIT_BOUNDS[0])
+        self.max_in_flight = max(self.max_in_flight * DECREASE_FACTOR, 1)
+        self._tokens = min(self._tokens, 1)
+        self._record_metrics()
+
+    def _record_metrics(self):
+        metrics.set_value("cinema_http_rate_limit", round(self.rate, 3), host=self.host)
+        metrics.set_value("cinema_http_max_in_flight", int(self.max_in_flight), host=self.host)
+
+
+# the connections pool of a host cannot hold more requests in flight, see http_client.set_concurrency()
+_max_in_flight = max(HTTP_POOL_SIZE, FETCH_CONCURRENCY)
+_limiters: Dict[str, HostRateLimiter] = {}
+_limiters_lock = Lock()
+_saved_limits: Optional[dict] = None
+# processes sharing the hosts, see set_shard()
+_shards = 1
+_shard_limits_path: Optional[Path] = None
+
+
+def _load_limits(path: Path = RATE_LIMITS_PATH) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def limiter(host: str) -> HostRateLimiter:
+    """Return the rate limiter of `host`, starting at its saved rate, or at the share of a shard."""
+    global _saved_limits
+    with _limiters_lock:
+        if host not in _limiters:
+            if _saved_limits is None:
+                _saved_limits = _load_limits()
+            saved = _saved_limits.get(host, {})
+            rate = min(max(saved.get("rate", RATE_LIMIT_INITIAL), RATE_LIMIT_BOUNDS[0]), RATE_LIMIT_BOUNDS[1])
+            _limiters[host] = HostRateLimiter(
+                host,
+                rate=max(rate / _shards, RATE_LIMIT_BOUNDS[0]),
+                max_in_flight=min(max(saved.get("max_in_flight", 2) / _shards, 1), _max_in_flight),
+                max_rate=max(RATE_LIMIT_BOUNDS[1] / _shards, RATE_LIMIT_BOUNDS[0]),
+            )
+        return _limiters[host]
+
+
+def set_shard(shards: int, limits_path: Path):
+    """
+    Run as one of `shards` processes fetching from the same hosts at the same time: the saved rates are split
+    between them, and this process saves its own to `limits_path` instead, see merge_limits().
+    """
+    global _shards, _shard_limits_path, _saved_limits
+    with _limiters_lock:
+        _shards = shards
+        _shard_limits_path = limits_path
+        # a worker process may run several shards in turn
+        _limiters.clear()
+        _saved_limits = None
+
+
+def set_max_in_flight(max_in_flight: int):
+    global _max_in_flight
+    with _limiters_lock:
+        _max_in_flight = max_in_flight
+        for host_limiter in _limiters.values():
+            host_limiter.max_in_flight = min(host_limiter.max_in_flight, max_in_flight)
+
+
+def _write_limits(path: Path, limits: dict):
+    write_atomically(path, json.dumps(limits, indent=2, sort_keys=True).encode())
+
+
+def save_limits():
+    """
+    Save the rates learned so far for the next runs, and record them in the run metrics.
+    A shard only saves the rates of its hosts, to its own limits path.
+    """
+    with _limiters_lock:
+        if not _limiters:
+            return
+        limits = {} if _shard_limits_path else dict(_saved_limits or {})
+        for host, host_limiter in _limiters.items():
+            limits[host] = {"rate": round(host_limiter.rate, 3), "max_in_flight": round(host_limiter.max_in_flight, 3)}
+            host_limiter._record_metrics()
+    _write_limits(_shard_limits_path or RATE_LIMITS_PATH, limits)
+
+
+def merge_limits(shards_limits_paths: Iterable[Path], shards: int):
+    """
+    Save the rates learned by the `shards` of a run. The rate of a host is the average share of the shards which
+    requested it, times `shards`: the next run splits it again between every shard.
+    """
+    shards_limits = [_load_limits(path) for path in shards_limits_paths]
+    hosts = {host for limits in shards_limits for host in limits}
+    if not hosts:
+        return
+    limits = _load_limits()
+    for host in hosts:
+        shares = [shard_limits[host] for shard_limits in shards_limits if host in shard_limits]
+        rate = sum(share["rate"] for share in shares) / len(shares) * shards
+        max_in_flight = sum(share["max_in_flight"] for share in shares) / len(shares) * shards
+        limits[host] = {"rate": round(min(rate, RATE_LIMIT_BOUNDS[1]), 3), "max_in_flight": round(max_in_flight, 3)}
+    _write_limits(RATE_LIMITS_PATH, limits)
@@ -0,0 +1,232 @@
+"""
+Built-in HTTP server of the daemon, serving the generated pages without a separate web server.
+
+Pages are kept in memory, compressed with every compressor of precompress.py, with strong ETags answered with
+`304 Not Modified`. They are loaded again after each refresh and swapped at once, so that a refresh is never
+served half done. Stylesheets, icons and posters are served with long cache lifetimes.
+"""
+
+import asyncio
+import hashlib
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from threading import Event, Thread
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from cinema.precompress import COMPRESSORS
+from cinema.settings import SERVER_HOST, SERVER_PORT, STATIC_MAX_AGE, TEMPLATES
+
+
+# Content-Encoding of the compressors extensions, by order of preference
+ENCODINGS = {".br": "br", ".gz": "gzip"}
+KEEP_ALIVE_TIMEOUT = 15  # seconds an idle connection is kept open
+POSTER_MAX_AGE = 365 * 24 * 3600  # posters are named after their content
+REASONS = {
+    200: "OK",
+    301: "Moved Permanently",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+}
+
+
+@dataclass(frozen=True)
+class Resource:
+    """A served file, with its body by Content-Encoding (None for the uncompressed one)."""
+
+    content_type: str
+    cache_control: str
+    bodies: Dict[Optional[str], bytes]
+    etag: str
+
+    def negotiate(self, accept_encoding: str) -> Tuple[Optional[str], bytes, str]:
+        """Return the encoding, body and strong ETag (one per encoding) to answer `accept_encoding` with."""
+        accepted = set()
+        for coding in accept_encoding.split(","):
+            name, _, params = coding.partition(";")
+            if params.strip().replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                accepted.add(name.strip().lower())
+        for encoding in ENCODINGS.values():
+            if encoding in self.bodies and (encoding in accepted or "*" in accepted):
+                return encoding, self.bodies[encoding], f'"{self.etag}-{encoding}"'
+        return None, self.bodies[None], f'"{self.etag}"'
+
+
+def _compressed_resource(path: Path, content_type: str, cache_control: str) -> Resource:
+    """Load `path` and its compressed versions, reusing the up to date siblings written by precompress.py."""
+    data = path.read_bytes()
+    bodies = {None: data}
+    source_mtime_ns = path.stat().st_mtime_ns
+    for extension, compress in COMPRESSORS.items():
+        sibling = path.with_name(path.name + extension)
+        if sibling.is_file() and sibling.stat().st_mtime_ns == source_mtime_ns:
+            bodies[ENCODINGS[extension]] = sibling.read_bytes()
+        else:
+            bodies[ENCODINGS[extension]] = compress(data)
+    return Resource(content_type, cache_control, bodies, hashlib.sha256(data).hexdigest()[:32])
+
+
+def _page(path: Path, previous: Optional[Resource]) -> Resource:
+    """Load the page at `path`, `previous` is returned as is if the page did not change, to not compress it again."""
+    if previous is not None and hashlib.sha256(path.read_bytes()).hexdigest()[:32] == previous.etag:
+        return previous
+    # browsers revalidate pages on every visit, which costs a 304 when they did not change
+    return _compressed_resource(path, "text/html; charset=utf-8", "no-cache")
+
+
+class PagesServer:
+    """Serve the pages generated in `out_path`, from memory, until `stop()` is called."""
+
+    def __init__(self, out_path: Path, host: str = SERVER_HOST, port: int = SERVER_PORT):
+        self.out_path = out_path
+        self.host = host
+        self.port = port
+        # by URL path, only ever replaced as a whole
+        self.pages: Dict[str, Resource] = {}
+        self._static: Dict[str, Resource] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._thread: Optional[Thread] = None
+        self._error: Optional[Exception] = None
+
+    def load_pages(self):
+        """Load the pages of `out_path` and swap them with the served ones."""
+        paths = {"/index.html": self.out_path / "index.html"}
+        for path in sorted(self.out_path.glob("*/*.html")):
+            paths[f"/{path.parent.name}/{path.name}"] = path
+        paths = {url_path: path for url_path, path in paths.items() if path.is_file()}
+        previous_pages = self.pages
+        # zlib and brotli release the GIL while compressing, threads are enough to use every core
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            pages = executor.map(lambda item: _page(item[1], previous_pages.get(item[0])), paths.items())
+            self.pages = dict(zip(paths, pages))
+        print(f"{len(self.pages)} pages served.")
+
+    def _static_file(self, url_path: str) -> Optional[Resource]:
+        """Stylesheets and icons of the templates, or a poster of `out_path`."""
+        directory, _, name = url_path[1:].partition("/")
+        if directory not in ("css", "pic") or not name or "/" in name or name.startswith("."):
+            return None
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        path = TEMPLATES / directory / name
+        if path.is_file():
+            if url_path not in self._static:
+                self._static[url_path] = _compressed_resource(path, content_type, f"public, max-age={STATIC_MAX_AGE}")
+            return self._static[url_path]
+        path = self.out_path / "pic" / name
+        if directory == "pic" and path.is_file():
+            # posters are already compressed, and too many to be kept in memory
+            return Resource(
+                content_type, f"public, max-age={POSTER_MAX_AGE}, immutable", {None: path.read_bytes()}, name
+            )
+        return None
+
+    async def _response(self, method: str, target: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD"}, b""
+        url_path = unquote(urlsplit(target).path)
+        if url_path.endswith("/"):
+            url_path += "index.html"
+        pages = self.pages
+        resource = pages.get(url_path)
+        if resource is None and f"{url_path}/index.html" in pages:
+            # pages link to "../css/...", the cities URLs need their trailing slash
+            return 301, {"Location": target.split("?")[0] + "/"}, b""
+        if resource is None:
+            resource = await asyncio.to_thread(self._static_file, url_path)
+        if resource is None:
+            return 404, {"Content-Type": "text/plain; charset=utf-8"}, b"Not Found"
+
+        encoding, body, etag = resource.negotiate(headers.get("accept-encoding", ""))
+        response_headers = {"ETag": etag, "Cache-Control": resource.cache_control}
+        if len(resource.bodies) > 1:
+            response_headers["Vary"] = "Accept-Encoding"
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and (
+            if_none_match.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+        ):
+            return 304, response_headers, b""
+        response_headers["Content-Type"] = resource.content_type
+        if encoding:
+            response_headers["Content-Encoding"] = encoding
+        return 200, response_headers, body
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            keep_alive = True
+            while keep_alive:
+                request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                request = request_line.decode("latin-1").split()
+                if len(request) != 3 or not request[2].startswith("HTTP/1."):
+                    status, response_headers, body, method, keep_alive = 400, {}, b"", "GET", False
+                else:
+                    method, target, version = request
+                    status, response_headers, body = await self._response(method, target, headers)
+                    connection = headers.get("connection", "").lower()
+                    # requests bodies are not read, the connection cannot be reused after one
+                    keep_alive = (
+                        method in ("GET", "HEAD")
+                        and "content-length" not in headers
+                        and "transfer-encoding" not in headers
+                        and (connection == "keep-alive" if version == "HTTP/1.0" else connection != "close")
+                    )
+
+                if status != 304:
+                    response_headers["Content-Length"] = str(len(body))
+                response_headers["Connection"] = "keep-alive" if keep_alive else "close"
+                head = f"HTTP/1.1 {status} {REASONS[status]}\r\n" + "".join(
+                    f"{name}: {value}\r\n" for name, value in response_headers.items()
+                )
+                writer.write(head.encode("latin-1") + b"\r\n")
+                if method != "HEAD" and status != 304:
+                    writer.write(body)
+                await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, ConnectionError):
+            # idle or broken connection, or a line over the StreamReader limit
+            pass
+        finally:
+            writer.close()
+
+    async def _serve(self, started: Event):
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            self._error = e
+            return
+        finally:
+            started.set()
+        print(f"Serving {self.out_path} on http://{self.host}:{self.port}/")
+        async with server:
+            await self._stopping.wait()
+
+    def start(self):
+        """Load the pages and serve them from a background thread, raise OSError if the port cannot be listened to."""
+        self.load_pages()
+        started = Event()
+        self._thread = Thread(target=asyncio.run, args=(self._serve(started),), name="pages-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        if self._error:
+            raise self._error
+
+    def stop(self):
+        if self._loop is not None and self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._stopping.set)
+            self._thread.join(KEEP_ALIVE_TIMEOUT)
@@ -19,3 +19,87 @@ MAIN_CITY = "Besançon"
 COMPRESS_PIC = True
 
 GECKO_DRIVER_PATH = PROJECT_PATH / "geckodriver"
+
+FETCH_CONCURRENCY = int(os.getenv("FETCH_CONCURRENCY") or 8)  # max simultaneous requests to a source
+
+# shared HTTP client, see http_client.py
+HTTP_TIMEOUT = (
+    float(os.getenv("HTTP_CONNECT_TIMEOUT") or 5),  # seconds to establish a connection
+    float(os.getenv("HTTP_READ_TIMEOUT") or 30),  # seconds to wait for the server to send data
+)
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES") or 4)  # retries on connection errors, 429 and 5xx
+HTTP_BACKOFF_FACTOR = 0.5  # retries wait 0.5s, 1s, 2s, 4s...
+HTTP_BACKOFF_JITTER = 0.3  # ...plus up to 0.3s of random jitter
+HTTP_POOL_SIZE = 10  # kept-alive connections per host
+# seconds a run may spend fetching, and a single resource (retries included) may take, before the last known shows
+# are used instead
+RUN_DEADLINE = float(os.getenv("RUN_DEADLINE") or 15 * 60)
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE") or 60)
+
+# on-disk cache of the sources responses, see http_cache.py
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE") != "0"
+CACHE_PATH = Path(os.getenv("CACHE_PATH") or PROJECT_PATH / "cache")
+# seconds before a cached day of shows is revalidated, by distance from today (the last one applies beyond)
+SHOWTIMES_CACHE_TTLS = (
+    1 * 3600,  # today: schedules may change during the day
+    6 * 3600,  # tomorrow
+    12 * 3600,  # the day after
+    30 * 3600,  # further days rarely change, a nightly run can reuse the previous night's data
+)
+# the daemon refreshes further days once a day: within the hour before the same refresh of the next day
+DAEMON_SHOWTIMES_CACHE_TTLS = SHOWTIMES_CACHE_TTLS[:-1] + (23 * 3600,)
+# seconds before the cached details of a film (synopsis, poster...) are revalidated
+DETAILS_CACHE_TTL = 3 * 24 * 3600
+
+# adaptive rate of requests to each host, learned from its responses and kept between runs, see rate_limit.py
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT") != "0"
+RATE_LIMIT_INITIAL = float(os.getenv("RATE_LIMIT_INITIAL") or 5)  # requests per second to a host never seen before
+RATE_LIMIT_BOUNDS = (0.2, float(os.getenv("RATE_LIMIT_MAX") or 50))  # min and max requests per second to a host
+RATE_LIMITS_PATH = CACHE_PATH / "rate_limits.json"
+
+# posters no page references any more are deleted, least recently used first, above these bounds
+POSTERS_MAX_BYTES = int(os.getenv("POSTERS_MAX_BYTES") or 200 * 1024 * 1024)
+POSTERS_MAX_FILES = int(os.getenv("POSTERS_MAX_FILES") or 5000)
+
+# write .gz (and .br if the brotli package is installed) siblings of generated pages, for nginx gzip_static
+PRECOMPRESS = os.getenv("PRECOMPRESS") == "1"
+
+# seconds between two refreshes of the daemon, the cache TTLs above decide which days are fetched again
+DAEMON_INTERVAL = float(os.getenv("DAEMON_INTERVAL") or SHOWTIMES_CACHE_TTLS[0])
+
+# reuse the shows of the previous run for the days which did not change, and refresh the first ROLLING_EAGER_DAYS
+# whatever the cache TTLs, see allocine.fetch_next_week_shows
+ROLLING_WINDOW = os.getenv("ROLLING_WINDOW") == "1"
+ROLLING_EAGER_DAYS = 2  # today and tomorrow, where most changes happen
+
+# only inline today's shows in cities pages, other days are loaded when their tab is opened
+LAZY_DAYS = os.getenv("LAZY_DAYS") == "1"
+
+# fetched shows are saved here, so that pages can be rendered again without fetching, see snapshot.py
+SNAPSHOT_PATH = Path(os.getenv("SNAPSHOT_PATH") or CACHE_PATH / "snapshot")
+
+# work directory of sharded runs, to be shared by the machines running shards, see sharding.py
+SHARDS_PATH = Path(os.getenv("SHARDS_PATH") or CACHE_PATH / "shards")
+
+# metrics of the last run, see metrics.py
+METRICS_JSON = Path(os.getenv("METRICS_JSON") or CACHE_PATH / "metrics.json")
+METRICS_TEXTFILE = Path(os.environ["METRICS_TEXTFILE"]) if os.getenv("METRICS_TEXTFILE") else None  # node_exporter
+
+# directory where stages profiles are written, profiling is disabled if not set, see profiling.py
+PROFILE_PATH = Path(os.environ["CINEMA_PROFILE"]) if os.getenv("CINEMA_PROFILE") else None
+
+# seconds each source type may take to fetch its shows, within the run deadline, the run goes on without the sources
+# which are late; None for the whole run deadline
+SOURCES_TIME_BUDGETS = {
+    "allocine": float(os.environ["ALLOCINE_TIME_BUDGET"]) if os.getenv("ALLOCINE_TIME_BUDGET") else None,
+    "custom": float(os.getenv("CUSTOM_TIME_BUDGET") or 180),  # a web browser may be started
+}
+
+# "selenium" scrapes the Besançon calendar with a web browser, "http" reads it from the page data, falling back to a
+# web browser; the latter is opt-in until its parser is checked against a saved copy of the live page
+BESANCON_SCRAPER = os.getenv("BESANCON_SCRAPER") or "selenium"
+
+# built-in HTTP server of the daemon (`main.py daemon --serve`), see server.py
+SERVER_HOST = os.getenv("SERVER_HOST") or "127.0.0.1"
+SERVER_PORT = int(os.getenv("SERVER_PORT") or 8080)
+STATIC_MAX_AGE = 7 * 24 * 3600  # seconds browsers keep stylesheets and icons, posters are never changed
@@ -0,0 +1,86 @@
+"""
+Sharded runs: cities are split into shards, each one fetched and rendered by its own process, possibly on another
+machine sharing the work directory, then a light merge step completes the snapshot and writes the files shared by
+every city.
+
+Each shard writes its city pages and posters straight to the output directory (shards never share a city), and the
+snapshot of its cities, its posters index, its rates of requests and its metrics to its directory,
+`<workdir>/shard-<index>-of-<count>`, which the merge step consumes: files shared by the shards, such as the posters
+index, are only written by the merge step.
+"""
+
+import json
+from pathlib import Path
+from shutil import rmtree
+from typing import Dict, List, Tuple
+
+from cinema import metrics, rate_limit
+from cinema.models import Cinema, FilmShow
+from cinema.posters import merge_indexes
+from cinema.snapshot import last_snapshot, merge_with_snapshot, save_snapshot
+
+
+# files of a shard directory, besides its snapshot and metrics
+POSTERS_INDEX_FILENAME = "posters_index.json"
+RATE_LIMITS_FILENAME = "rate_limits.json"
+
+
+def shard_cities(cinemas: Dict[str, List[Cinema]], count: int) -> List[Dict[str, List[Cinema]]]:
+    """
+    Split cities into `count` shards of about as many cinemas, in the `cinemas` order within each shard.
+    The split only depends on `cinemas`, every machine computes the same one.
+    """
+    loads = [0] * count
+    shard_indexes = {}
+    # biggest cities first, each one to the least loaded shard
+    for city in sorted(cinemas, key=lambda city: (-len(cinemas[city]), city)):
+        shard_indexes[city] = loads.index(min(loads))
+        loads[shard_indexes[city]] += len(cinemas[city])
+    return [
+        {city: city_cinemas for city, city_cinemas in cinemas.items() if shard_indexes[city] == index}
+        for index in range(count)
+    ]
+
+
+def shard_path(workdir: Path, index: int, count: int) -> Path:
+    return workdir / f"shard-{index}-of-{count}"
+
+
+def merge_shards(workdir: Path, count: int, pic_directory: Path) -> Tuple[Dict[str, List[List[FilmShow]]], int]:
+    """
+    Save the shows of the done shards to the snapshot, their posters to the index of `pic_directory` and their rates
+    of requests, and add their metrics to the ones of this run.
+    Return the shows of every city, and the number of shards which failed or are not done: their cities keep their
+    snapshot shows. Done shards are removed from `workdir`, so that they are never merged twice.
+    """
+    shards_shows = {}
+    done_paths = []
+    merged = 0
+    for index in range(count):
+        path = shard_path(workdir, index, count)
+        # written last by a shard, whether it failed or not
+        if not (path / "metrics.json").is_file():
+            print(f"Shard {index} of {count} is not done, its cities keep their last known shows.")
+            metrics.inc("cinema_shards_total", result="missing")
+            continue
+        done_paths.append(path)
+        shard_summary = json.loads((path / "metrics.json").read_text())
+        metrics.merge(shard_summary)
+        # a shard may fail once its snapshot is saved, e.g. while rendering its pages
+        shard_success = any(value["value"] for value in shard_summary["metrics"].get("cinema_last_run_success", []))
+        snapshot = last_snapshot(path / "snapshot") if shard_success else None
+        if snapshot is None:
+            print(f"Shard {index} of {count} failed, its cities keep their last known shows.")
+            metrics.inc("cinema_shards_total", result="failed")
+            continue
+        shards_shows.update((city, shows) for city in snapshot if (shows := snapshot.readable_shows(city)) is not None)
+        merged += 1
+        metrics.inc("cinema_shards_total", result="merged")
+
+    one_week_shows = merge_with_snapshot(shards_shows, shards_shows, refreshed_days=7)
+    save_snapshot(one_week_shows)
+    merge_indexes((path / POSTERS_INDEX_FILENAME for path in done_paths), pic_directory)
+    rate_limit.merge_limits((path / RATE_LIMITS_FILENAME for path in done_paths), count)
+    for path in done_paths:
+        rmtree(path)
+    return one_week_shows, count - merged
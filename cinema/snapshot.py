@@ -0,0 +1,192 @@
+"""
+Snapshot of fetched shows, so that pages can be rendered again without fetching anything.
+
+A snapshot is a directory holding a manifest and one gzipped JSON file per city, so that cities can be loaded
+one at a time. Shows are stored as rows of values, in the field order recorded in the manifest.
+"""
+
+import gzip
+import json
+from dataclasses import fields, replace
+from datetime import date
+from itertools import chain
+from pathlib import Path
+from time import time
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional
+from urllib.parse import quote
+
+from cinema.exceptions import InvalidSnapshot
+from cinema.files import write_atomically
+from cinema.models import FilmShow
+from cinema.settings import SNAPSHOT_PATH
+
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILENAME = "manifest.json"
+
+
+def _city_filename(city: str) -> str:
+    return f"{quote(city.lower(), safe='')}.json.gz"
+
+
+def save_snapshot(
+    one_week_shows: Mapping[str, List[List[FilmShow]]],
+    snapshot_path: Path = SNAPSHOT_PATH,
+    first_day: Optional[date] = None,
+):
+    """Save shows as returned by sources, `first_day` being the day of their first list of shows."""
+    field_names = [field.name for field in fields(FilmShow)]
+    cities = {}
+    for city, city_one_week_shows in one_week_shows.items():
+        rows = [
+            [[getattr(show, name) for name in field_names] for show in day_shows] for day_shows in city_one_week_shows
+        ]
+        cities[city] = _city_filename(city)
+        write_atomically(
+            snapshot_path / cities[city], gzip.compress(json.dumps(rows, separators=(",", ":")).encode(), mtime=0)
+        )
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "first_day": (first_day or date.today()).isoformat(),
+        "saved_at": time(),
+        "fields": field_names,
+        "cities": cities,
+    }
+    # the manifest is written last: a snapshot is never seen with missing cities files
+    write_atomically(snapshot_path / MANIFEST_FILENAME, json.dumps(manifest, indent=2).encode())
+
+    for path in snapshot_path.glob("*.json.gz"):
+        if path.name not in cities.values():
+            path.unlink()
+
+
+class Snapshot(Mapping[str, List[List[FilmShow]]]):
+    """Shows of a saved snapshot by city, each city being loaded on first access."""
+
+    def __init__(self, snapshot_path: Path = SNAPSHOT_PATH):
+        self.path = snapshot_path
+        try:
+            with open(snapshot_path / MANIFEST_FILENAME) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            raise InvalidSnapshot(snapshot_path, str(e))
+        if manifest.get("version") != SNAPSHOT_VERSION:
+            raise InvalidSnapshot(snapshot_path, f"unsupported version {manifest.get('version')}")
+
+        self.first_day = date.fromisoformat(manifest["first_day"])
+        self.saved_at: Optional[float] = manifest.get("saved_at")
+        self._fields = manifest["fields"]
+        self._cities_filenames: Dict[str, str] = manifest["cities"]
+        self._loaded_cities: Dict[str, List[List[FilmShow]]] = {}
+        self._unreadable_cities: Dict[str, InvalidSnapshot] = {}
+
+    def _load_city(self, city: str) -> List[List[FilmShow]]:
+        try:
+            with gzip.open(self.path / self._cities_filenames[city]) as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            raise InvalidSnapshot(self.path, f"{city}: {e}")
+        return [[FilmShow(**dict(zip(self._fields, row))) for row in day_rows] for day_rows in rows]
+
+    def __getitem__(self, city: str) -> List[List[FilmShow]]:
+        """Raise InvalidSnapshot if the file of `city` cannot be read, e.g. deleted by a concurrent save."""
+        if city not in self._loaded_cities:
+            if city not in self._cities_filenames:
+                raise KeyError(city)
+            if city in self._unreadable_cities:
+                raise self._unreadable_cities[city]
+            try:
+                self._loaded_cities[city] = self._load_city(city)
+            except InvalidSnapshot as e:
+                print(e)
+                self._unreadable_cities[city] = e
+                raise
+        return self._loaded_cities[city]
+
+    def readable_shows(self, city: str) -> Optional[List[List[FilmShow]]]:
+        """Shows of `city`, None if it is not in the snapshot or if its file cannot be read."""
+        try:
+            return self.get(city)
+        except InvalidSnapshot:
+            return None
+
+    def __contains__(self, city: object) -> bool:
+        # without loading the city, as Mapping.__contains__ would: its file may not be readable
+        return city in self._cities_filenames
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._cities_filenames)
+
+    def __len__(self) -> int:
+        return len(self._cities_filenames)
+
+
+def last_snapshot(snapshot_path: Path = SNAPSHOT_PATH) -> Optional[Snapshot]:
+    """The saved snapshot, or None on first run or if it is incompatible."""
+    try:
+        return Snapshot(snapshot_path)
+    except InvalidSnapshot:
+        return None
+
+
+def _cinema_day_shows(snapshot: Optional[Snapshot], city: str, cinema_name: str, day: date) -> Optional[List[FilmShow]]:
+    """Shows of a cinema for a day in `snapshot`, or None if the snapshot does not cover this day."""
+    city_shows = snapshot.readable_shows(city) if snapshot is not None else None
+    if city_shows is None:
+        return None
+    day_index = (day - snapshot.first_day).days
+    if not 0 <= day_index < len(city_shows):
+        return None
+    return [show for show in city_shows[day_index] if show.cinema == cinema_name]
+
+
+def stale_shows(snapshot: Optional[Snapshot], city: str, cinema_name: str, day: date) -> List[FilmShow]:
+    """Shows of a cinema for a day in `snapshot`, marked as stale, to be used when they cannot be fetched."""
+    return [replace(show, stale=True) for show in _cinema_day_shows(snapshot, city, cinema_name, day) or []]
+
+
+def known_shows(snapshot: Optional[Snapshot], city: str, cinema_name: str, day: date) -> Optional[List[FilmShow]]:
+    """
+    Shows of a cinema for a day in `snapshot`, to be reused if they did not change since it was saved.
+    None if the snapshot does not cover this day, or if its shows are stale.
+    """
+    shows = _cinema_day_shows(snapshot, city, cinema_name, day)
+    return None if shows is None or any(show.stale for show in shows) else shows
+
+
+def merge_with_snapshot(
+    fresh_shows: Mapping[str, List[List[FilmShow]]],
+    refreshed_cities: Iterable[str],
+    refreshed_days: int,
+    snapshot_path: Path = SNAPSHOT_PATH,
+    days_count: int = 7,
+) -> Dict[str, List[List[FilmShow]]]:
+    """
+    Complete freshly fetched shows, starting today, with the ones of the saved snapshot:
+    cities which were not refreshed keep their snapshot shows, and refreshed cities keep their snapshot shows
+    for the days beyond `refreshed_days`. Snapshot days are shifted if the snapshot was saved on a previous day.
+    Cities whose snapshot file cannot be read have no previous shows, and are dropped if they were not refreshed.
+    """
+    # on first run, or with an incompatible snapshot, there is nothing to complete with
+    snapshot = last_snapshot(snapshot_path)
+    offset = (date.today() - snapshot.first_day).days if snapshot else 0
+    refreshed_cities = set(refreshed_cities)
+
+    merged_shows = {}
+    for city in chain(snapshot or [], (city for city in fresh_shows if snapshot is None or city not in snapshot)):
+        previous_days = snapshot.readable_shows(city) if snapshot is not None else None
+        if previous_days is None and city not in refreshed_cities:
+            continue
+        previous_days = previous_days or []
+        days = [
+            previous_days[day_index + offset] if 0 <= day_index + offset < len(previous_days) else []
+            for day_index in range(days_count)
+        ]
+        if city in refreshed_cities:
+            fresh_days = fresh_shows.get(city, [])
+            days[:refreshed_days] = [
+                fresh_days[day_index] if day_index < len(fresh_days) else [] for day_index in range(refreshed_days)
+            ]
+        merged_shows[city] = days
+    return merged_shows
@@ -0,0 +1,51 @@
+import unittest
+from datetime import date
+from pathlib import Path
+
+from cinema.cinemas_sources.besancon_scraper import parse_calendar
+from cinema.exceptions import UnexpectedPageLayout
+
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+class ParseCalendarTest(unittest.TestCase):
+    def test_calendar_of_the_cinema_page(self):
+        calendar = parse_calendar((FIXTURES / "les2scenes_cinema.html").read_text())
+
+        self.assertEqual(
+            calendar,
+            {
+                date(2024, 6, 4): [
+                    ("18h15 The Big Lebowski", "https://les2scenes.fr/cinema/the-big-lebowski"),
+                    ("20h30 Les Herbes sèches", "https://les2scenes.fr/cinema/les-herbes-seches"),
+                ],
+                date(2024, 6, 5): [
+                    ("16h The Big Lebowski", "https://les2scenes.fr/cinema/the-big-lebowski"),
+                    ("21h Le Règne animal", "https://les2scenes.fr/cinema/le-regne-animal"),
+                ],
+            },
+        )
+
+    def test_dated_links_outside_of_the_calendar_are_not_shows(self):
+        html = (FIXTURES / "les2scenes_cinema.html").read_text()
+
+        calendar = parse_calendar(html)
+
+        # the fixture news, {"title": "Saison 2024", "url": "/actualites/saison", "date": "2024-06-01"}
+        self.assertNotIn(date(2024, 6, 1), calendar)
+        self.assertNotIn(
+            "https://les2scenes.fr/actualites/saison", [url for entries in calendar.values() for _, url in entries]
+        )
+
+    def test_page_without_calendar(self):
+        html = (FIXTURES / "les2scenes_cinema.html").read_text()
+
+        with self.assertRaises(UnexpectedPageLayout):
+            parse_calendar(html.replace('"calendar":', '"agenda":'))
+        with self.assertRaises(UnexpectedPageLayout):
+            parse_calendar(html.replace("drupal-settings-json", "other-settings"))
+
+
+if __name__ == "__main__":
+    unittest.main()